@@ -0,0 +1,124 @@
+# --- بنچمارک حالت چند پروسه‌ای (WORKERS) ---
+# race:  چند پروسه روی یک wheel.db همزمان claim_spin و claim_stock می‌زنند؛ در پایان بررسی می‌شود که هر کاربر
+#        در هر دور دقیقاً یک بار برنده چرخش شده و هیچ جایزه‌ای بیشتر از موجودی‌اش سهم نگرفته باشد.
+# e2e:   ربات واقعی با WORKERS=N پشت سرور جعلی تلگرام اجرا می‌شود و /start کاربران از webhook front-end به
+#        workerها پخش می‌شود؛ تأخیر انتها به انتها و throughput گزارش می‌شود.
+#
+# اجرا:  python -m bench.cluster race --procs 4 --users 5000
+#        python -m bench.cluster e2e --workers 4 --requests 400
+import argparse, asyncio, collections, multiprocessing, os, queue, signal, sys, tempfile, time
+
+from bench.fake_telegram import FakeTelegram
+from bench.webhook_latency import ROOT, SECRET, TOKEN, free_port, percentile
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Multi-process workers sharing one SQLite store")
+    ap.add_argument("mode", choices=["race", "e2e"])
+    ap.add_argument("--procs", type=int, default=4, help="race: competing processes")
+    ap.add_argument("--users", type=int, default=5000, help="race: users every process tries to claim")
+    ap.add_argument("--stock", type=int, default=100, help="race: stock of the contested prize")
+    ap.add_argument("--workers", type=int, default=4, help="e2e: WORKERS")
+    ap.add_argument("--requests", type=int, default=400, help="e2e: /start updates pushed through the webhook")
+    ap.add_argument("--timeout", type=float, default=120, help="race: seconds to wait for the processes")
+    return ap.parse_args()
+
+def race_worker(data_dir, users, stock, ready, start, results):
+    os.environ.update(DATA_DIR=data_dir, STORAGE="sqlite", WORKERS="2")
+    sys.path.insert(0, ROOT)
+    import wheel_bot
+    ready.put(os.getpid()) # wheel_bot import شده و جدول‌ها ساخته شده‌اند
+    start.wait()
+    won, claimed = [], 0
+    started = time.perf_counter()
+    for uid in range(users):
+        if wheel_bot.store.claim_spin(str(uid), 1):
+            won.append(uid)
+            if wheel_bot.store.claim_stock(1, "ویژه", stock) is not None:
+                claimed += 1
+    results.put((won, claimed, time.perf_counter() - started))
+
+def collect(q, procs, deadline):
+    # یک پیام از صف؛ اگر پروسه‌ای با خطا تمام شده یا زمان گذشته باشد RuntimeError، تا بنچمارک گیر نکند
+    while True:
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            dead = [p.exitcode for p in procs if p.exitcode not in (None, 0)]
+            if dead:
+                raise RuntimeError(f"race process exited with code {dead[0]}")
+            if time.monotonic() > deadline:
+                raise RuntimeError("timed out waiting for race processes")
+
+def race(args):
+    data_dir = tempfile.mkdtemp(prefix="wheel-bench-")
+    ready, start, results = multiprocessing.Queue(), multiprocessing.Event(), multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=race_worker, args=(data_dir, args.users, args.stock, ready, start, results))
+             for _ in range(args.procs)]
+    for p in procs:
+        p.start()
+    deadline = time.monotonic() + args.timeout
+    try:
+        for _ in procs:
+            collect(ready, procs, deadline)
+        start.set()
+        outcomes = [collect(results, procs, deadline) for _ in procs]
+    except RuntimeError as e:
+        print(e)
+        for p in procs:
+            p.terminate()
+        return False
+    finally:
+        for p in procs:
+            p.join()
+
+    wins = collections.Counter(uid for won, _, _ in outcomes for uid in won)
+    claimed = sum(c for _, c, _ in outcomes)
+    slowest = max(t for _, _, t in outcomes)
+    print(f"procs={args.procs} users={args.users} claims={args.users * args.procs} elapsed={slowest:.2f}s "
+          f"throughput={args.users * args.procs / slowest:,.0f} claims/s")
+    print(f"  per-process wins: {[len(won) for won, _, _ in outcomes]}")
+    ok = len(wins) == args.users and max(wins.values()) == 1 and claimed == min(args.stock, args.users)
+    print(f"  users won={len(wins)} max wins per user={max(wins.values())} stock claimed={claimed}/{args.stock}")
+    print("exactly once, no oversell" if ok else "RACE DETECTED")
+    return ok
+
+async def e2e(args):
+    fake = await FakeTelegram().start()
+    port = free_port()
+    env  = dict(os.environ, BOT_TOKEN=TOKEN, BOT_API_URL=fake.base_url, STORAGE="sqlite",
+                DATA_DIR=tempfile.mkdtemp(prefix="wheel-bench-"), PYTHONWARNINGS="ignore",
+                WORKERS=str(args.workers), WORKER_BASE_PORT=str(free_port()),
+                WEBHOOK_URL=f"http://127.0.0.1:{port}", WEBHOOK_PORT=str(port), WEBHOOK_SECRET=SECRET,
+                SEND_RATE="0", SPIN_GLOBAL_RATE="0")
+    bot = await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT, "wheel_bot.py"), env=env,
+                                               stdout=asyncio.subprocess.DEVNULL)
+    ok = True
+    try:
+        await asyncio.wait_for(fake.ready.wait(), 30)
+        await asyncio.sleep(2) # workerها بالا بیایند
+        sem = asyncio.Semaphore(32)
+        async def one(uid):
+            async with sem:
+                return await fake.roundtrip(uid, "/start")
+        started = time.perf_counter()
+        latencies = await asyncio.wait_for(asyncio.gather(*(one(1000 + i) for i in range(args.requests))), 60)
+        elapsed = time.perf_counter() - started
+        ms = [x * 1000 for x in latencies]
+        print(f"workers={args.workers} requests={len(ms)} p50={percentile(ms, 0.50):.1f}ms "
+              f"p99={percentile(ms, 0.99):.1f}ms throughput={len(ms) / elapsed:,.0f} updates/s")
+    except asyncio.TimeoutError:
+        print("TIMED OUT waiting for replies")
+        ok = False
+    finally:
+        bot.send_signal(signal.SIGINT)
+        await bot.wait()
+        await fake.stop()
+    return ok
+
+def main():
+    args = parse_args()
+    ok = race(args) if args.mode == "race" else asyncio.run(e2e(args))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
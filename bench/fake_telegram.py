@@ -0,0 +1,159 @@
+# --- سرور جعلی Bot API تلگرام برای بنچمارک‌های محلی ---
+# همان مسیرهای /bot<token>/<method> را جواب می‌دهد که python-telegram-bot صدا می‌زند
+# (getMe، getUpdates، setWebhook، sendMessage، ...). آپدیت‌ها یا از طریق getUpdates (polling)
+# تحویل داده می‌شوند یا اگر webhook تنظیم شده باشد با POST به ربات فرستاده می‌شوند.
+# برای هر chat_id زمان اولین پاسخ ربات ثبت می‌شود تا تأخیر انتها به انتها اندازه‌گیری شود.
+import asyncio, itertools, json, time
+from urllib.parse import parse_qsl
+
+import httpx
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Wheel", "username": "wheel_bench_bot"}
+
+class ApiError(Exception):
+    # جواب خطای Bot API (مثلاً 403 برای کاربری که ربات را مسدود کرده)
+    def __init__(self, code, description):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+
+    def payload(self):
+        return {"ok": False, "error_code": self.code, "description": self.description}
+
+class FakeTelegram:
+    def __init__(self, api_latency=0.0):
+        self.api_latency = api_latency      # تأخیر شبکه شبیه‌سازی‌شده هر فراخوانی API و هر تحویل آپدیت (ثانیه)
+        self.updates  = asyncio.Queue()     # آپدیت‌های منتظر getUpdates
+        self.calls    = []                  # (method, params) همه فراخوانی‌های ربات
+        self.waiters  = {}                  # chat_id -> Future زمان پاسخ
+        self.blocked  = set()               # chat_idهایی که ربات را مسدود کرده‌اند (sendMessage -> 403)
+        self.webhook  = None                # (url, secret_token)
+        self.ready    = asyncio.Event()     # ربات به سرور وصل شده (اولین getUpdates یا setWebhook)
+        self.update_ids  = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.http = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(self._serve, host, port)
+        self.port   = self.server.sockets[0].getsockname()[1]
+        self.http   = httpx.AsyncClient(limits=httpx.Limits(max_connections=None, max_keepalive_connections=None))
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        await self.http.aclose()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    # --- HTTP خام (keep-alive) ---
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    key, _, value = line.decode().partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body   = await reader.readexactly(int(headers.get("content-length", 0)))
+                method = request_line.split()[1].decode().rsplit("/", 1)[-1]
+                try:
+                    status, payload = 200, {"ok": True, "result": await self.call(method, self._params(headers, body))}
+                except ApiError as e:
+                    status, payload = e.code, e.payload()
+                payload = json.dumps(payload).encode()
+                writer.write(b"HTTP/1.1 %d X\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (status, len(payload), payload))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def _params(self, headers, body):
+        kind = headers.get("content-type", "")
+        if kind.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if kind.startswith("application/x-www-form-urlencoded"):
+            return dict(parse_qsl(body.decode()))
+        return {} # multipart (ارسال فایل) برای بنچمارک لازم نیست
+
+    # --- متدهای Bot API ---
+    def _message(self, params):
+        return {"message_id": next(self.message_ids), "date": int(time.time()), "from": BOT_USER,
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"}, "text": params.get("text", "")}
+
+    async def call(self, method, params):
+        self.calls.append((method, params))
+        if method in ("getUpdates", "setWebhook"):
+            self.ready.set()
+        if method == "getUpdates": # تأخیر شبکه روی رسیدن جواب، بعد از آماده شدن آپدیت‌ها
+            updates = await self._get_updates(float(params.get("timeout", 0)))
+            await asyncio.sleep(self.api_latency)
+            return updates
+        await asyncio.sleep(self.api_latency)
+        if method == "getMe":
+            return BOT_USER
+        if method == "setWebhook":
+            self.webhook = (params["url"], params.get("secret_token"))
+            return True
+        if method == "deleteWebhook":
+            self.webhook = None
+            return True
+        if method == "getChatMember":
+            return {"status": "member", "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "U"}}
+        if method == "sendMessage" and int(params.get("chat_id", 0)) in self.blocked:
+            raise ApiError(403, "Forbidden: bot was blocked by the user")
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            waiter = self.waiters.pop(int(params.get("chat_id", 0)), None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(time.perf_counter())
+            return self._message(params)
+        return True
+
+    async def _get_updates(self, timeout):
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(self.updates.get(), timeout))
+        except asyncio.TimeoutError:
+            return batch
+        while not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    # --- تزریق آپدیت ---
+    def message_update(self, uid, text):
+        update = {
+            "update_id": next(self.update_ids),
+            "message": {
+                "message_id": next(self.message_ids), "date": int(time.time()), "text": text,
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": uid, "is_bot": False, "first_name": f"U{uid}"},
+            },
+        }
+        if text.startswith("/"):
+            update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return update
+
+    async def push(self, update, secret=None):
+        # ارسال آپدیت به ربات؛ خروجی کد وضعیت HTTP در حالت webhook (یا None در حالت polling)
+        if self.webhook is None:
+            await self.updates.put(update)
+            return None
+        url, expected = self.webhook
+        await asyncio.sleep(self.api_latency) # همان تأخیر شبکه‌ای که جواب getUpdates دارد
+        response = await self.http.post(url, json=update,
+                                        headers={"X-Telegram-Bot-Api-Secret-Token": secret or expected or ""})
+        return response.status_code
+
+    async def roundtrip(self, uid, text):
+        # تأخیر از تحویل آپدیت تا اولین پاسخ ربات به همان chat
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[uid] = waiter
+        started = time.perf_counter()
+        await self.push(self.message_update(uid, text))
+        return await waiter - started
@@ -0,0 +1,132 @@
+# --- بار مصنوعی روی هندلرهای ربات (کاملاً آفلاین) ---
+# سناریوها:
+#   registration  هجوم ثبت‌نام: هر کاربر /spin -> ارسال شماره -> ارسال نام -> /spin
+#   spin-burst    دور جدید با admin_next_round و بلافاصله /spin همه کاربران ثبت‌نام‌شده
+#   export-burst  خروجی CSV گزارش کاربران در حین همان هجوم /spin
+#   broadcast     اطلاع‌رسانی دور جدید به همه کاربران (۱٪ ربات را مسدود کرده‌اند) همزمان با /spin یک دهم کاربران؛
+#                 با SEND_RATE=1000 (سقف اطلاع‌رسانی پولی تلگرام) اولویت /spin در صف ارسال هم دیده می‌شود
+# خروجی هر سناریو: p50/p99 تأخیر پردازش هر آپدیت، throughput و بیشترین RSS پروسه.
+#
+# اجرا:  python -m bench.load spin-burst --users 100000 --storage sqlite --api-latency-ms 5
+import argparse, asyncio, os, resource, statistics, sys, tempfile, time
+
+from bench.synthetic import phone_for
+
+ROOT     = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_ID = 1
+FIRST_UID = 10_000_000
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Replay synthetic Telegram traffic against the bot handlers")
+    ap.add_argument("scenario", choices=["registration", "spin-burst", "export-burst", "broadcast"])
+    ap.add_argument("--users", type=int, default=10000)
+    ap.add_argument("--storage", choices=["json", "sqlite"], default="json")
+    ap.add_argument("--api-latency-ms", type=float, default=0.0, help="simulated latency of every Bot API call")
+    ap.add_argument("--concurrency", type=int, default=256, help="updates processed at once (like concurrent_updates)")
+    return ap.parse_args()
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # لینوکس: کیلوبایت
+
+class Runner:
+    def __init__(self, app, concurrency):
+        self.app     = app
+        self.sem     = asyncio.Semaphore(concurrency)
+        self.samples = []
+
+    async def feed(self, update):
+        async with self.sem:
+            started = time.perf_counter()
+            await self.app.process_update(update)
+            self.samples.append(time.perf_counter() - started)
+
+def seed_users(w, uids):
+    # کاربران ثبت‌نام‌شده که در دور فعلی هنوز نچرخیده‌اند، مستقیم در store نوشته می‌شوند
+    rows = {str(uid): {"phone": phone_for(uid), "name": "کاربر تست", "round": 0, "spin_count": 0} for uid in uids}
+    if isinstance(w.store, w.SqliteStore):
+        sql = "INSERT OR REPLACE INTO users (uid, phone, name, round, spin_count) VALUES (?, ?, ?, ?, ?)"
+        w.store._write(*[(sql, (uid, d["phone"], d["name"], d["round"], d["spin_count"])) for uid, d in rows.items()])
+    else: # جدول کاربران مستقیم نوشته می‌شود، مثل users.tbl بعد از یک ادغام
+        w.UserTable.write(w.store.snapshot_path, ((uid, w.encode_user(d)) for uid, d in sorted(rows.items())))
+        w.store.table = w.UserTable(w.store.snapshot_path)
+
+async def registration(w, app, factory, runner, uids):
+    async def one(uid):
+        for update in (factory.text(uid, "/spin"), factory.contact(uid, phone_for(uid)),
+                       factory.text(uid, "علی حسینی"), factory.text(uid, "/spin")):
+            await runner.feed(update)
+    await asyncio.gather(*(one(uid) for uid in uids))
+    return {"registered": sum(1 for _, d in w.store.iter_users() if "name" in d)}
+
+async def spin_burst(w, app, factory, runner, uids, export=False):
+    seed_users(w, uids)
+    started = time.perf_counter()
+    await app.process_update(factory.callback(ADMIN_ID, "admin_next_round"))
+    extra = {"next_round_ms": round((time.perf_counter() - started) * 1000, 2)}
+    spins = asyncio.gather(*(runner.feed(factory.text(uid, "/spin")) for uid in uids))
+    if export:
+        started = time.perf_counter()
+        await app.process_update(factory.callback(ADMIN_ID, "report_export_csv"))
+        extra["export_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    await spins
+    extra["spun"] = sum(1 for _ in w.store.iter_users(round=w.config["current_round"]))
+    return extra
+
+async def broadcast(w, app, api, factory, runner, uids):
+    seed_users(w, uids)
+    api.blocked.update(uids[::100])
+    await app.process_update(factory.callback(ADMIN_ID, "admin_next_round"))
+    started = time.perf_counter()
+    await app.process_update(factory.callback(ADMIN_ID, "admin_broadcast_start"))
+    await asyncio.gather(*(runner.feed(factory.text(uid, "/spin")) for uid in uids[::10]))
+    await w.broadcaster.task
+    s = w.broadcaster.state
+    return {"broadcast_s": round(time.perf_counter() - started, 1), "sent": s["sent"], "blocked": s["blocked"],
+            "failed": s["failed"], "msgs_per_s": round(s["sent"] / (time.perf_counter() - started))}
+
+async def run(w, args):
+    from bench.stub_bot import stub_app
+    from bench.synthetic import UpdateFactory
+
+    app, api = await stub_app(w, args.api_latency_ms / 1000)
+    w.roles.set(ADMIN_ID, "admin")
+    factory = UpdateFactory(app.bot)
+    runner  = Runner(app, args.concurrency)
+    uids    = range(FIRST_UID, FIRST_UID + args.users)
+
+    started = time.perf_counter()
+    if args.scenario == "registration":
+        extra = await registration(w, app, factory, runner, uids)
+    elif args.scenario == "broadcast":
+        extra = await broadcast(w, app, api, factory, runner, uids)
+    else:
+        extra = await spin_burst(w, app, factory, runner, uids, export=args.scenario == "export-burst")
+    elapsed = time.perf_counter() - started
+
+    await app.shutdown() # persistence آخرین بار در store نوشته می‌شود، پس store بعد از آن بسته می‌شود
+    await w.writer.close()
+    await w.store.close()
+
+    ms = [x * 1000 for x in runner.samples]
+    print(f"scenario={args.scenario} storage={args.storage} users={args.users} updates={len(ms)} "
+          f"p50={percentile(ms, 0.50):.2f}ms p99={percentile(ms, 0.99):.2f}ms mean={statistics.mean(ms):.2f}ms "
+          f"throughput={len(ms) / elapsed:,.0f} updates/s peak_rss={peak_rss_mb():.0f}MB api_calls={len(api.calls)} "
+          + " ".join(f"{k}={v}" for k, v in extra.items()))
+
+def main():
+    args = parse_args()
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="wheel-bench-")
+    os.environ["STORAGE"]  = args.storage
+    os.environ.setdefault("CONCURRENT_UPDATES", str(args.concurrency))
+    os.environ.setdefault("SEND_RATE", "0")        # هندلرها اندازه گرفته می‌شوند، نه صف ارسال
+    os.environ.setdefault("SPIN_GLOBAL_RATE", "0")
+    sys.path.insert(0, ROOT)
+    import wheel_bot
+    asyncio.run(run(wheel_bot, args))
+
+if __name__ == "__main__":
+    main()
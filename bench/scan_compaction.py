@@ -0,0 +1,64 @@
+# --- بررسی پیمایش کاربران وقتی ادغام ژورنال وسط آن تمام می‌شود (STORAGE=json) ---
+# اطلاع‌رسانی همگانی یک iter_users را چند دقیقه باز نگه می‌دارد و خروجی گزارش چند ثانیه؛ در همین مدت کاربران
+# تازه ثبت‌نام می‌کنند و هر COMPACT_EVERY تغییر یک ادغام اجرا می‌شود. این اسکریپت پیمایش را تکه‌تکه جلو می‌برد،
+# بین تکه‌ها کاربر جدید اضافه می‌کند و ادغام را اجباری اجرا می‌کند، و در پایان بررسی می‌کند که همه کاربرانی که
+# هنگام شروع پیمایش وجود داشتند (در جدول یا فقط در حافظه) دقیقاً یک بار و به ترتیب uid برگشته باشند.
+#
+# اجرا:  python -m bench.scan_compaction --users 20000 --new 5000
+import argparse, asyncio, os, sys, tempfile
+from itertools import islice
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_UID = 10_000_000
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="iter_users must see every user even if a compaction finishes mid-scan")
+    ap.add_argument("--users", type=int, default=20000, help="users already in users.tbl")
+    ap.add_argument("--new", type=int, default=5000, help="users only in memory when the scan starts")
+    ap.add_argument("--compactions", type=int, default=5, help="compactions forced during the scan")
+    return ap.parse_args()
+
+async def compact(store):
+    # مثل close: اگر ادغام خودکار (هر COMPACT_EVERY تغییر) در جریان است اول منتظر آن می‌مانیم
+    if store._compacting is not None:
+        await store._compacting
+    await store.compact()
+
+async def run(w, args):
+    store = w.store
+    for i in range(args.users):
+        store.update_user(str(FIRST_UID + i), name="کاربر تست", round=1)
+    await compact(store)
+    for i in range(args.new):
+        store.update_user(str(FIRST_UID + args.users + i), name="کاربر تازه", round=1)
+    expected = sorted(str(FIRST_UID + i) for i in range(args.users + args.new))
+
+    scan  = store.iter_users(round=1)
+    step  = len(expected) // (args.compactions + 1) + 1
+    later = FIRST_UID * 2 # کاربرانی که بعد از شروع پیمایش می‌آیند (ممکن است دیده شوند یا نه)
+    seen  = []
+    for n in range(args.compactions + 1):
+        seen += [uid for uid, _ in islice(scan, step)]
+        for i in range(100):
+            store.update_user(str(later + n * 100 + i), name="بعد از شروع", round=1)
+        await compact(store)
+    seen += [uid for uid, _ in scan]
+
+    await w.writer.close()
+    await store.close()
+    seen = [uid for uid in seen if int(uid) < later]
+    ok = seen == expected
+    print(f"users={args.users} new={args.new} compactions={args.compactions} returned={len(seen)}/{len(expected)}")
+    print("every user seen exactly once" if ok else f"MISSING {len(set(expected) - set(seen))} users")
+    return ok
+
+def main():
+    args = parse_args()
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="wheel-bench-")
+    os.environ["STORAGE"]  = "json"
+    sys.path.insert(0, ROOT)
+    import wheel_bot
+    sys.exit(0 if asyncio.run(run(wheel_bot, args)) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# --- زمان راه‌اندازی ربات با تعداد زیادی مکالمه ذخیره‌شده ---
+# ابتدا N مکالمه نیمه‌کاره (ثبت‌نام در مرحله NAME) و user_data برای هر کاربر مستقیم در store نوشته می‌شود،
+# بعد در یک پروسه تازه import ربات و app.initialize() (که مکالمه‌ها را بارگذاری می‌کند) زمان‌گیری می‌شود.
+# import خود telegram.ext حدود ۰.۴ ثانیه است و به تعداد مکالمه‌ها ربطی ندارد.
+#
+# اجرا:  python -m bench.state_startup --conversations 100000 --storage sqlite
+import argparse, asyncio, json, os, subprocess, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_UID = 10_000_000
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Measure bot startup time with many persisted conversations")
+    ap.add_argument("--conversations", type=int, default=100000)
+    ap.add_argument("--storage", choices=["json", "sqlite"], default="json")
+    return ap.parse_args()
+
+async def seed(n):
+    import wheel_bot as w
+    for uid in range(FIRST_UID, FIRST_UID + n):
+        w.store.save_conversation("register", (uid, uid), w.NAME)
+        w.store.save_user_data(uid, {"stage": w.NAME})
+    await w.writer.close()
+    await w.store.close()
+
+async def measure():
+    import time
+    started = time.perf_counter()
+    import wheel_bot as w
+    imported = time.perf_counter()
+    from bench.stub_bot import stub_app
+    app, api = await stub_app(w)
+    ready = time.perf_counter()
+    register = next(h for h in app.handlers[0] if getattr(h, "name", None) == "register")
+    print(json.dumps({"import_s": round(imported - started, 3), "initialize_s": round(ready - imported, 3),
+                      "total_s": round(ready - started, 3), "conversations": len(register._conversations)}))
+    await app.shutdown()
+    await w.writer.close()
+    await w.store.close()
+
+def main():
+    if sys.argv[1:2] == ["--child"]:
+        sys.path.insert(0, ROOT)
+        asyncio.run(seed(int(sys.argv[2])) if len(sys.argv) > 2 else measure())
+        return
+    args = parse_args()
+    env  = dict(os.environ, DATA_DIR=tempfile.mkdtemp(prefix="wheel-bench-"), STORAGE=args.storage, PYTHONWARNINGS="ignore")
+    subprocess.run([sys.executable, "-m", "bench.state_startup", "--child", str(args.conversations)], env=env, cwd=ROOT, check=True)
+    out = subprocess.run([sys.executable, "-m", "bench.state_startup", "--child"], env=env, cwd=ROOT, check=True,
+                         capture_output=True, text=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    print(f"storage={args.storage} stored={args.conversations} " + " ".join(f"{k}={v}" for k, v in result.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# --- بنچمارک فشار: موجودی محدود جوایز زیر چرخش‌های همزمان ---
+# هزاران /spin را همزمان (مثل Application با concurrent_updates) به هندلر spin می‌دهد،
+# برای بررسی عضویت تأخیر شبکه شبیه‌سازی می‌کند تا چرخش‌ها واقعاً در هم تنیده شوند،
+# و در پایان بررسی می‌کند که هیچ جایزه‌ای بیشتر از موجودی‌اش داده نشده باشد.
+#
+# اجرا:  python bench/stock_contention.py --users 20000 --storage sqlite
+import argparse, asyncio, collections, os, random, sys, tempfile, time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Concurrent spin stress test for per-round prize stock")
+    ap.add_argument("--users", type=int, default=20000, help="number of concurrent /spin updates")
+    ap.add_argument("--storage", choices=["json", "sqlite"], default="json")
+    ap.add_argument("--latency-ms", type=float, default=5.0, help="max simulated get_chat_member latency")
+    return ap.parse_args()
+
+class FakeBot:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def get_chat_member(self, channel, uid):
+        await asyncio.sleep(random.uniform(0, self.latency))
+        return SimpleNamespace(status="member")
+
+async def noop_reply(*args, **kwargs):
+    pass
+
+def fake_update(uid):
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=uid),
+        message=SimpleNamespace(reply_text=noop_reply),
+    )
+
+async def run(w, args):
+    w.commit_config(channel_username="@bench", prizes=[
+        {"name": "💰 ۵۰ هزار تومان", "weight": 5,  "stock": 50},
+        {"name": "🎁 تخفیف 10٪",     "weight": 5,  "stock": 500},
+        {"name": "🏆 جایزه ویژه",    "weight": 1,  "stock": 3},
+        {"name": "❌ هیچی",          "weight": 20},
+    ])
+    for uid in range(args.users):
+        w.store.update_user(str(uid), phone=f"98912{uid:07d}", name="کاربر تست")
+
+    context = SimpleNamespace(bot=FakeBot(args.latency_ms / 1000), user_data={})
+    started = time.perf_counter()
+    await asyncio.gather(*(w.spin(fake_update(uid), context) for uid in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    won = collections.Counter(data.get("last_prize") for _, data in w.store.iter_users())
+    print(f"storage={args.storage} spins={args.users} elapsed={elapsed:.3f}s throughput={args.users / elapsed:,.0f} spins/s")
+    ok = True
+    for prize in w.config["prizes"]:
+        limit = prize.get("stock")
+        used  = w.stock.used.get(prize["name"], 0)
+        print(f"  {prize['name']}: won={won[prize['name']]} claimed={used} stock={limit if limit is not None else '∞'}")
+        if limit is not None and (won[prize["name"]] > limit or used != won[prize["name"]]):
+            ok = False
+    await w.writer.close()
+    await w.store.close()
+    print("no oversell" if ok else "OVERSOLD")
+    return ok
+
+def main():
+    args = parse_args()
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="wheel-bench-")
+    os.environ["STORAGE"]  = args.storage
+    os.environ.setdefault("PRIZE_RNG_SEED", "1")
+    sys.path.insert(0, ROOT)
+    import wheel_bot
+    sys.exit(0 if asyncio.run(run(wheel_bot, args)) else 1)
+
+if __name__ == "__main__":
+    main()
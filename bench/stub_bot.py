@@ -0,0 +1,39 @@
+# --- Bot جعلی برای اجرای هندلرها بدون شبکه ---
+# StubRequest جای HTTPXRequest می‌نشیند: هر فراخوانی Bot API با تأخیر شبیه‌سازی‌شده جواب
+# داده و ثبت می‌شود (همان منطق سرور جعلی FakeTelegram، بدون HTTP). با stub_app یک Application
+# کامل (همان build_app ربات) ساخته می‌شود که آپدیت‌ها مستقیم با process_update به آن داده می‌شوند.
+import json
+
+from telegram.ext import ApplicationBuilder
+from telegram.request import BaseRequest
+
+from bench.fake_telegram import ApiError, FakeTelegram
+
+TOKEN = "123456:BENCH"
+
+class StubRequest(BaseRequest):
+    def __init__(self, api):
+        self.api = api # FakeTelegram؛ فقط متد call آن استفاده می‌شود
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        params = request_data.parameters if request_data else {}
+        try:
+            result = await self.api.call(url.rsplit("/", 1)[-1], params)
+        except ApiError as e:
+            return e.code, json.dumps(e.payload()).encode()
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+async def stub_app(wheel_bot, api_latency=0.0):
+    api = FakeTelegram(api_latency=api_latency)
+    app = wheel_bot.build_app(
+        ApplicationBuilder().token(TOKEN).request(StubRequest(api)).get_updates_request(StubRequest(api))
+    )
+    await app.initialize()
+    return app, api
@@ -0,0 +1,40 @@
+# --- تولید آپدیت‌های مصنوعی تلگرام ---
+# آپدیت‌ها به شکل dict ساخته و با Update.de_json به اشیای واقعی python-telegram-bot تبدیل می‌شوند
+# تا همان مسیر فیلترها و ConversationHandler ها طی شود.
+import itertools, time
+
+from telegram import Update
+
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self.ids = itertools.count(1)
+
+    def _user(self, uid):
+        return {"id": uid, "is_bot": False, "first_name": f"U{uid}"}
+
+    def _message(self, uid, **fields):
+        return {"message_id": next(self.ids), "date": int(time.time()),
+                "chat": {"id": uid, "type": "private"}, "from": self._user(uid), **fields}
+
+    def _update(self, **fields):
+        return Update.de_json({"update_id": next(self.ids), **fields}, self.bot)
+
+    def text(self, uid, text):
+        fields = {"text": text}
+        if text.startswith("/"):
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._update(message=self._message(uid, **fields))
+
+    def contact(self, uid, phone):
+        return self._update(message=self._message(uid, contact={"phone_number": phone, "first_name": f"U{uid}", "user_id": uid}))
+
+    def callback(self, uid, data):
+        # پیامی که دکمه زیر آن زده شده از طرف خود ربات است
+        message = self._message(uid, text="panel")
+        message["from"] = {"id": self.bot.id, "is_bot": True, "first_name": "Wheel"}
+        return self._update(callback_query={"id": str(next(self.ids)), "from": self._user(uid), "chat_instance": "bench",
+                                            "data": data, "message": message})
+
+def phone_for(uid):
+    return f"98912{uid:07d}"
@@ -0,0 +1,78 @@
+# --- زمان import و حافظه ربات با تعداد زیادی کاربر: users.tbl در برابر users.json ---
+# N کاربر یک بار در هر دو قالب ساخته می‌شوند و هر اندازه‌گیری در یک پروسه تازه انجام می‌شود:
+#   table  import ربات با users.tbl (فقط mmap؛ کاربران با اولین دسترسی parse می‌شوند)
+#   json   همان import به اضافه json.load کل users.json، یعنی کاری که JsonStore قبلاً هنگام import می‌کرد
+# بعد از import، زمان اولین get_user، find_by_phone و یک پیمایش کامل iter_users هم گزارش می‌شود.
+#
+# اجرا:  python -m bench.user_startup --users 1000000
+import argparse, json, os, resource, subprocess, sys, tempfile, time
+
+from bench.synthetic import phone_for
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_UID = 10_000_000
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Import time and RSS with many users: compact table vs users.json")
+    ap.add_argument("--users", type=int, default=1_000_000)
+    return ap.parse_args()
+
+def user(uid):
+    return {"phone": phone_for(uid), "name": "کاربر تست", "round": uid % 5, "spin_count": uid % 7,
+            "last_prize": "🎁 تخفیف 10٪", "last_spin_at": 1.7e9 + uid}
+
+def seed(n):
+    sys.path.insert(0, ROOT)
+    import wheel_bot as w
+    users = {str(uid): user(uid) for uid in range(FIRST_UID, FIRST_UID + n)}
+    with open(w.USERS_FILE, "w", encoding="utf-8") as f:
+        json.dump(users, f, ensure_ascii=False, separators=(",", ":"))
+    w.UserTable.write(w.USERS_TABLE, ((uid, w.encode_user(d)) for uid, d in sorted(users.items())))
+    return {"users_json_mb": round(os.path.getsize(w.USERS_FILE) / 2**20, 1),
+            "users_tbl_mb": round(os.path.getsize(w.USERS_TABLE) / 2**20, 1)}
+
+def measure(mode, n):
+    import telegram.ext # مشترک بین هر دو حالت؛ خارج از زمان‌گیری
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    import wheel_bot as w
+    if mode == "json":
+        with open(w.USERS_FILE, "r", encoding="utf-8") as f:
+            users = json.load(f)
+    imported = time.perf_counter()
+    result = {"import_s": round(imported - started, 3),
+              "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)}
+    uid = str(FIRST_UID + n // 2)
+    t = time.perf_counter()
+    data = users[uid] if mode == "json" else w.store.get_user(uid)
+    result["first_get_user_us"] = round((time.perf_counter() - t) * 1e6, 1)
+    t = time.perf_counter()
+    if mode == "json":
+        found = [u for u, d in users.items() if d["phone"] == data["phone"]]
+    else:
+        found = w.store.find_by_phone(data["phone"])
+    result["find_by_phone_ms"] = round((time.perf_counter() - t) * 1000, 1)
+    t = time.perf_counter()
+    count = sum(1 for _ in (users.items() if mode == "json" else w.store.iter_users()))
+    result["iter_all_s"] = round(time.perf_counter() - t, 2)
+    assert found == [uid] and count == n
+    return result
+
+def main():
+    if sys.argv[1:2] == ["--child"]:
+        mode, n = sys.argv[2], int(sys.argv[3])
+        print(json.dumps(seed(n) if mode == "seed" else measure(mode, n)))
+        return
+    args = parse_args()
+    env = dict(os.environ, DATA_DIR=tempfile.mkdtemp(prefix="wheel-bench-"), STORAGE="json", PYTHONWARNINGS="ignore")
+    def child(mode):
+        out = subprocess.run([sys.executable, "-m", "bench.user_startup", "--child", mode, str(args.users)],
+                             env=env, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+        return json.loads(out.strip().splitlines()[-1])
+    sizes = child("seed")
+    print(f"users={args.users} " + " ".join(f"{k}={v}" for k, v in sizes.items()))
+    for mode in ("json", "table"):
+        print(f"  {mode:5s} " + " ".join(f"{k}={v}" for k, v in child(mode).items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# --- بنچمارک تأخیر: long polling در برابر webhook ---
+# ربات واقعی (python wheel_bot.py) در یک پروسه جدا اجرا و با BOT_API_URL به سرور جعلی تلگرام
+# وصل می‌شود. برای هر حالت چند صد /start فرستاده می‌شود و زمان از تحویل آپدیت تا رسیدن پاسخ
+# ربات به سرور اندازه‌گیری می‌شود. در حالت webhook رد شدن secret token اشتباه هم بررسی می‌شود.
+#
+# اجرا:  python -m bench.webhook_latency --requests 500 --api-latency-ms 20
+import argparse, asyncio, json, os, signal, socket, statistics, sys, tempfile
+
+from bench.fake_telegram import FakeTelegram
+
+ROOT   = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN  = "123456:BENCH"
+SECRET = "bench-secret"
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="End-to-end latency of polling vs webhook mode against a fake Bot API")
+    ap.add_argument("--requests", type=int, default=300, help="updates per mode")
+    ap.add_argument("--concurrency", type=int, default=10, help="updates in flight at once")
+    ap.add_argument("--api-latency-ms", type=float, default=20.0, help="simulated network latency of every Bot API call")
+    return ap.parse_args()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+async def run_mode(mode, args):
+    fake = await FakeTelegram(api_latency=args.api_latency_ms / 1000).start()
+    env  = dict(os.environ, BOT_TOKEN=TOKEN, BOT_API_URL=fake.base_url,
+                DATA_DIR=tempfile.mkdtemp(prefix="wheel-bench-"), PYTHONWARNINGS="ignore",
+                SEND_RATE="0", SPIN_GLOBAL_RATE="0") # انتقال آپدیت اندازه گرفته می‌شود، نه محدودیت نرخ
+    if mode == "webhook":
+        port = free_port()
+        env.update(WEBHOOK_URL=f"http://127.0.0.1:{port}", WEBHOOK_PORT=str(port), WEBHOOK_SECRET=SECRET)
+    bot = await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT, "wheel_bot.py"), env=env,
+                                               stdout=asyncio.subprocess.DEVNULL)
+    try:
+        await asyncio.wait_for(fake.ready.wait(), 30)
+        await asyncio.sleep(0.5) # فرصت برای بالا آمدن کامل سرور webhook / شروع polling
+
+        rejected = None
+        if mode == "webhook": # آپدیت با secret اشتباه باید رد شود
+            rejected = await fake.push(fake.message_update(999999, "/start"), secret="wrong")
+
+        sem = asyncio.Semaphore(args.concurrency)
+        async def one(uid):
+            async with sem:
+                return await fake.roundtrip(uid, "/start")
+        latencies = await asyncio.gather(*(one(1000 + i) for i in range(args.requests)))
+    finally:
+        bot.send_signal(signal.SIGINT)
+        await bot.wait()
+        await fake.stop()
+
+    subscribe = next(params for method, params in fake.calls if method in ("getUpdates", "setWebhook"))
+    ms = [x * 1000 for x in latencies]
+    line = (f"{mode:8s} n={len(ms)} p50={percentile(ms, 0.50):7.1f}ms p99={percentile(ms, 0.99):7.1f}ms "
+            f"mean={statistics.mean(ms):7.1f}ms allowed_updates={json.loads(subscribe.get('allowed_updates', 'null'))}")
+    if rejected is not None:
+        line += f" wrong-secret-status={rejected}"
+    print(line)
+
+async def run(args):
+    for mode in ("polling", "webhook"):
+        await run_mode(mode, args)
+
+def main():
+    asyncio.run(run(parse_args()))
+
+if __name__ == "__main__":
+    main()
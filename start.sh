@@ -1,9 +1,7 @@
 #!/bin/bash
 
-# Ensure the config.json and users.json files exist
-# This helps in case of initial deployment or disk issues
-touch config.json
-touch users.json
+# The bot creates its data files (config.json, users.tbl, ...) on first run.
+# Empty files left behind by older versions of this script are treated as missing.
 
 # Start the bot
 python wheel_bot.py
@@ -1,41 +1,281 @@
-import os, json, random
-from functools import wraps
+import os, io, json, random, asyncio, sqlite3, sys, time, threading, csv, tempfile, secrets, heapq, bisect, hashlib, math, signal
+import mmap, struct
+from array import array
+from functools import wraps, lru_cache
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, time as dtime
+from types import MappingProxyType
+from itertools import islice, chain
 from telegram import (
+    Bot,
     Update, InlineKeyboardButton, InlineKeyboardMarkup,
     KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
 )
 from telegram.ext import (
     ApplicationBuilder, ContextTypes, CommandHandler,
-    CallbackQueryHandler, MessageHandler, filters, ConversationHandler
+    CallbackQueryHandler, MessageHandler, filters, ConversationHandler,
+    TypeHandler, ApplicationHandlerStop, BaseRateLimiter, BasePersistence, PersistenceInput
 )
-from telegram.error import BadRequest
+from telegram.error import BadRequest, RetryAfter, Forbidden, TelegramError
+from telegram.helpers import escape_markdown
+
+try:
+    import openpyxl # اختیاری: فقط برای خروجی Excel گزارش کاربران
+except ImportError:
+    openpyxl = None
+
+try:
+    import tornado.web # اختیاری (python-telegram-bot[webhooks]): فقط برای front-end حالت WORKERS
+except ImportError:
+    tornado = None
 
 # --- تنظیمات مسیر فایل‌ها ---
-BASE_DIR    = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR    = os.getenv("DATA_DIR") or os.path.dirname(os.path.abspath(__file__)) # DATA_DIR برای جدا کردن داده‌ها (مثلاً در بنچمارک)
 CONFIG_FILE = os.path.join(BASE_DIR, "config.json")
-USERS_FILE  = os.path.join(BASE_DIR, "users.json")
+USERS_FILE  = os.path.join(BASE_DIR, "users.json")    # قالب قدیمی کاربران؛ در اولین اجرا به users.tbl تبدیل می‌شود
+USERS_TABLE = os.path.join(BASE_DIR, "users.tbl")     # جدول فشرده کاربران (حالت JSON)
+USERS_LOG   = os.path.join(BASE_DIR, "users.journal") # ژورنال تغییرات کاربران (هر خط یک تغییر)
+STOCK_FILE  = os.path.join(BASE_DIR, "stock.json")    # تعداد مصرف‌شده از موجودی جوایز در هر دور (حالت JSON)
+ROLES_FILE  = os.path.join(BASE_DIR, "roles.json")    # نقش‌های کاربران: ادمین/اپراتور/بیننده (حالت JSON)
+BROADCAST_FILE = os.path.join(BASE_DIR, "broadcast.json") # وضعیت آخرین اطلاع‌رسانی همگانی (حالت JSON)
+STATE_LOG   = os.path.join(BASE_DIR, "state.journal") # وضعیت مکالمه‌ها و user_data (حالت JSON)
+SPINS_LOG   = os.path.join(BASE_DIR, "spins.jsonl")   # تاریخچه فقط‌افزودنی همه چرخش‌ها (حالت JSON)
+STATS_FILE  = os.path.join(BASE_DIR, "stats.json")    # آمار تجمعی چرخش‌ها تا یک نقطه از spins.jsonl (حالت JSON)
+DB_FILE     = os.path.join(BASE_DIR, "wheel.db")      # پایگاه داده SQLite (در حالت STORAGE=sqlite)
+PROFILE_FILE = os.path.join(BASE_DIR, "profile.pstats") # نتیجه پروفایل نمونه‌ای (PROFILE_EVERY)
 
 # --- متغیرهای محیطی ---
 TOKEN       = os.getenv("BOT_TOKEN")               # توکن ربات
 ADMIN_PHONE = os.getenv("ADMIN_PHONE", "989366582052") # شماره ادمین
+ADMIN_PHONES = os.getenv("ADMIN_PHONES", ADMIN_PHONE)     # چند شماره ادمین، جدا شده با کاما
+STORAGE     = os.getenv("STORAGE", "json")           # json یا sqlite
+COMPACT_EVERY = int(os.getenv("COMPACT_EVERY", "5000"))  # بعد از این تعداد تغییر، ژورنال در فایل اصلی ادغام می‌شود
+FLUSH_WINDOW  = float(os.getenv("FLUSH_WINDOW", "0.2"))  # تغییراتی که در این بازه (ثانیه) برسند با هم نوشته می‌شوند
+MEMBER_TTL_POS = float(os.getenv("MEMBER_TTL_POS", "600")) # مدت اعتبار نتیجه «عضو است» در کش (ثانیه)
+MEMBER_TTL_NEG = float(os.getenv("MEMBER_TTL_NEG", "20"))  # مدت اعتبار نتیجه «عضو نیست» (کوتاه، تا بعد از عضویت زود باز شود)
+MEMBER_CACHE_SIZE = int(os.getenv("MEMBER_CACHE_SIZE", "100000")) # حداکثر تعداد ورودی‌های کش عضویت
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "256")) # تعداد آپدیت‌هایی که همزمان پردازش می‌شوند (۰ = یکی‌یکی)
+SPIN_USER_RATE   = float(os.getenv("SPIN_USER_RATE", "0.2"))  # /spin مجاز برای هر کاربر در ثانیه (۰.۲ = هر ۵ ثانیه یکی)
+SPIN_USER_BURST  = float(os.getenv("SPIN_USER_BURST", "3"))   # چند /spin پشت سر هم قبل از شروع محدودیت
+SPIN_GLOBAL_RATE = float(os.getenv("SPIN_GLOBAL_RATE", "500")) # سقف /spin در ثانیه برای کل ربات (۰ = بدون سقف)
+SEND_RATE  = float(os.getenv("SEND_RATE", "30"))  # سقف پیام خروجی در ثانیه (محدودیت تلگرام؛ ۰ = بدون صف)
+CHAT_RATE  = float(os.getenv("CHAT_RATE", "1"))   # پیام در ثانیه برای هر چت
+CHAT_BURST = float(os.getenv("CHAT_BURST", "3"))  # چند پیام پشت سر هم به یک چت قبل از شروع محدودیت
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "5")) # هر چند ثانیه وضعیت مکالمه‌ها و user_data ذخیره شود
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "64"))  # تعداد ارسال همزمان در اطلاع‌رسانی همگانی
+BROADCAST_BATCH   = int(os.getenv("BROADCAST_BATCH", "1000"))  # پیشرفت بعد از هر این تعداد کاربر ذخیره می‌شود
+RATE_BUCKETS_MAX = 50000 # بیشترین تعداد سطل؛ بیشتر از این، قدیمی‌ترین سطل‌ها حذف می‌شوند
+BOT_API_URL    = os.getenv("BOT_API_URL")  # برای سرور Bot API محلی/خودمیزبان (پیش‌فرض: https://api.telegram.org/bot)
+WEBHOOK_URL    = os.getenv("WEBHOOK_URL")  # آدرس عمومی (مثلاً https://bot.example.com)؛ اگر خالی باشد long polling استفاده می‌شود
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1") # سرور محلی پشت reverse proxy
+WEBHOOK_PORT   = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH   = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32) # اگر تنظیم نشود در هر اجرا تصادفی ساخته می‌شود
+WORKERS        = int(os.getenv("WORKERS", "0"))             # بیش از ۱: front-end + این تعداد پروسه worker (نیاز به sqlite و webhook)
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "18100")) # worker شماره i روی 127.0.0.1:WORKER_BASE_PORT+i
+WORKER_QUEUE   = int(os.getenv("WORKER_QUEUE", "10000"))    # آپدیت‌های منتظر هر worker در front-end (بیشتر از آن دور ریخته می‌شود)
+WORKER_INDEX   = int(os.environ["WORKER_INDEX"]) if "WORKER_INDEX" in os.environ else None # توسط front-end تنظیم می‌شود
+CONFIG_WATCH_INTERVAL = float(os.getenv("CONFIG_WATCH_INTERVAL", "2")) # هر چند ثانیه تغییر config.json بررسی شود (۰ = خاموش؛ فقط STORAGE=json)
+METRICS_PORT   = int(os.getenv("METRICS_PORT", "0"))         # پورت HTTP برای /metrics و /profile (۰ = خاموش)
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+LAG_INTERVAL   = float(os.getenv("LAG_INTERVAL", "0.5"))     # هر چند ثانیه تأخیر حلقه رویداد اندازه گرفته شود
+PROFILE_EVERY  = float(os.getenv("PROFILE_EVERY", "0"))      # هر چند ثانیه یک پنجره پروفایل ضبط شود (۰ = خاموش)
+PROFILE_WINDOW = float(os.getenv("PROFILE_WINDOW", "1"))     # طول هر پنجره پروفایل (ثانیه)
+PRIZE_RNG_SEED = os.getenv("PRIZE_RNG_SEED") # اگر تنظیم شود قرعه‌کشی قابل تکرار است؛ وگرنه از RNG امن سیستم استفاده می‌شود
 
 # --- حالت‌های مکالمه (برای ConversationHandler) ---
 PHONE, NAME, ADD_PRIZE_NAME, ADD_PRIZE_WEIGHT, EDIT_PRIZE_NAME, EDIT_PRIZE_WEIGHT = range(6)
 
+# --- متریک‌ها (قالب متنی Prometheus) ---
+# شمارنده‌ها و هیستوگرام‌ها در حافظه همین پروسه نگه داشته می‌شوند و روی METRICS_PORT در مسیر /metrics
+# سرو می‌شوند. observe و inc از ترد نوشتن (save_json) هم صدا زده می‌شوند، پس با یک lock محافظت می‌شوند.
+# مقدارهایی که از قبل جای دیگری شمرده می‌شوند (کش عضویت، صف ارسال، ...) با gauge فقط هنگام خواندن جمع می‌شوند.
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(METRIC_BUCKETS) + 1) # آخری: +Inf
+        self.sum    = 0.0
+        self.count  = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(METRIC_BUCKETS, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+def metric_labels(labels, **extra):
+    items = (*labels, *extra.items())
+    if not items:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in items) + "}"
+
+class Metrics:
+    def __init__(self):
+        self.kinds      = {} # name -> (type, help)
+        self.counters   = {} # (name, labels) -> مقدار
+        self.histograms = {} # (name, labels) -> Histogram
+        self.gauges     = {} # name -> تابعی که مقدار (یا {labels: مقدار}) را برمی‌گرداند
+        self.lock       = threading.Lock()
+
+    def describe(self, name, kind, help):
+        self.kinds[name] = (kind, help)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = Histogram()
+            h.observe(value)
+
+    def gauge(self, name, kind, help, read):
+        self.describe(name, kind, help)
+        self.gauges[name] = read
+
+    def render(self):
+        with self.lock:
+            series = {}
+            for (name, labels), value in self.counters.items():
+                series.setdefault(name, []).append(f"{name}{metric_labels(labels)} {value}")
+            for (name, labels), h in self.histograms.items():
+                lines, total = series.setdefault(name, []), 0
+                for bound, n in zip((*METRIC_BUCKETS, "+Inf"), h.counts):
+                    total += n
+                    lines.append(f"{name}_bucket{metric_labels(labels, le=bound)} {total}")
+                lines.append(f"{name}_sum{metric_labels(labels)} {h.sum:.6f}")
+                lines.append(f"{name}_count{metric_labels(labels)} {h.count}")
+        for name, read in self.gauges.items():
+            value = read()
+            values = value.items() if isinstance(value, dict) else [((), value)]
+            series[name] = [f"{name}{metric_labels(labels)} {v}" for labels, v in values]
+        out = []
+        for name in sorted(series):
+            kind, help = self.kinds.get(name, ("untyped", ""))
+            out += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", *series[name]]
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+metrics.describe("wheel_handler_seconds", "histogram", "Time spent in each update handler")
+metrics.describe("wheel_handler_errors_total", "counter", "Handler calls that raised")
+metrics.describe("wheel_telegram_api_seconds", "histogram", "Latency of Bot API calls made on the hot path")
+metrics.describe("wheel_telegram_api_errors_total", "counter", "Failed Bot API calls made on the hot path")
+metrics.describe("wheel_save_seconds", "histogram", "Time to write a JSON file (temp file + fsync + rename)")
+metrics.describe("wheel_save_bytes_total", "counter", "Bytes written by full JSON file saves")
+metrics.describe("wheel_flush_seconds", "histogram", "Duration of each write-behind flush")
+metrics.describe("wheel_loop_lag_seconds", "histogram", "Event loop scheduling delay")
+metrics.describe("wheel_prizes_drawn_total", "counter", "Prizes won, per round and prize")
+
 # --- توابع کمکی برای کار با فایل‌های JSON ---
 def load_json(path, default):
-    if not os.path.exists(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0: # فایل خالی (مثلاً ساخته‌شده با touch) یعنی پیش‌فرض
         with open(path, "w", encoding="utf-8") as f:
             json.dump(default, f, ensure_ascii=False, indent=2)
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
 def save_json(path, data):
-    with open(path, "w", encoding="utf-8") as f:
+    # اول در فایل موقت نوشته می‌شود تا قطع شدن وسط نوشتن فایل اصلی را خراب نکند
+    started = time.perf_counter()
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp, path)
+    name = os.path.basename(path)
+    metrics.observe("wheel_save_seconds", time.perf_counter() - started, file=name)
+    metrics.inc("wheel_save_bytes_total", size, file=name)
 
-# --- بارگذاری پیکربندی و اطلاعات کاربران ---
-config = load_json(CONFIG_FILE, {
+# بافرهای خطوط (ژورنال‌ها و spins.jsonl) deque هستند: حلقه رویداد append و ترد نوشتن popleft می‌کند و هر دو
+# اتمیک‌اند. با جابه‌جا کردن کل لیست، خطی که حلقه رویداد درست همان لحظه به لیست قبلی اضافه می‌کرد گم می‌شد.
+def drain(buf):
+    return [buf.popleft() for _ in range(len(buf))]
+
+# --- صف نوشتن با تأخیر (write-behind) ---
+# هندلرها فقط علامت «کثیف شدن» می‌زنند؛ یک تسک پس‌زمینه بعد از FLUSH_WINDOW ثانیه همه
+# علامت‌ها را با هم در thread pool می‌نویسد. پس صدها تغییر پشت سر هم فقط یک بار دیسک را درگیر می‌کنند
+# و حلقه رویداد هیچ‌وقت منتظر دیسک نمی‌ماند.
+class WriteBehind:
+    def __init__(self, window):
+        self.window = window
+        self.dirty  = {}   # نام -> تابع نوشتن (برای هر نام فقط آخرین تابع نگه داشته می‌شود)
+        self.marks  = 0    # تعداد تغییرات از آخرین نوشتن
+        self._task  = None
+        self.stats  = {"flushes": 0, "mutations": 0, "last_batch": 0, "max_batch": 0, "last_flush_ms": 0.0}
+
+    def mark(self, name, flush):
+        self.dirty[name] = flush
+        self.marks += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError: # بیرون از حلقه رویداد (مثلاً migrate): همان لحظه نوشته می‌شود
+            self.flush_now()
+            return
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+
+    def _take(self):
+        dirty, self.dirty = self.dirty, {}
+        batch, self.marks = self.marks, 0
+        return dirty, batch
+
+    def _apply(self, dirty):
+        failed = {}
+        for name, flush in dirty.items():
+            try:
+                flush()
+            except Exception as e:
+                print(f"Error flushing {name}: {e}")
+                failed[name] = flush
+        return failed
+
+    def _record(self, batch, started):
+        self.stats["flushes"]      += 1
+        self.stats["mutations"]    += batch
+        self.stats["last_batch"]    = batch
+        self.stats["max_batch"]     = max(self.stats["max_batch"], batch)
+        self.stats["last_flush_ms"] = (time.perf_counter() - started) * 1000
+        metrics.observe("wheel_flush_seconds", self.stats["last_flush_ms"] / 1000)
+
+    async def _run(self):
+        try:
+            while self.dirty:
+                await asyncio.sleep(self.window)
+                dirty, batch = self._take()
+                started = time.perf_counter()
+                failed  = await asyncio.get_running_loop().run_in_executor(None, self._apply, dirty)
+                self._record(batch, started)
+                for name, flush in failed.items(): # دفعه بعد دوباره تلاش می‌شود
+                    self.dirty.setdefault(name, flush)
+        finally:
+            self._task = None
+
+    def flush_now(self):
+        dirty, batch = self._take()
+        if dirty:
+            started = time.perf_counter()
+            self._apply(dirty)
+            self._record(batch, started)
+
+    async def close(self):
+        # هنگام خاموش شدن: منتظر نوشتن در حال اجرا می‌مانیم و باقی‌مانده را همان‌جا می‌نویسیم
+        if self._task is not None:
+            await self._task
+        self.flush_now()
+
+writer = WriteBehind(FLUSH_WINDOW)
+
+# --- پیکربندی پیش‌فرض (اگر هنوز چیزی ذخیره نشده باشد) ---
+DEFAULT_CONFIG = {
     "prizes":[
         {"name":"🎁 تخفیف 10٪", "weight":1},
         {"name":"💰 ۵۰ هزار تومان اعتبار", "weight":1},
@@ -45,38 +285,1776 @@ config = load_json(CONFIG_FILE, {
     ],
     "current_round": 1,
     "channel_username": "@mighnatis" # برای تست می توانید به کانال خودتان تغییر دهید
-})
-users  = load_json(USERS_FILE, {})   # {uid:{phone,name,round,spin_count}}
-
-# --- مجموعه ادمین‌ها (برای دسترسی سریع) ---
-ADMIN_IDS = set()
-
-# --- دکوراتور برای محدود کردن دسترسی به ادمین‌ها ---
-def admin_only(func):
-    @wraps(func)
-    async def wrapper(update:Update, context:ContextTypes.DEFAULT_TYPE):
-        uid   = update.effective_user.id
-        phone = users.get(str(uid), {}).get("phone")
-        if phone and phone.endswith(ADMIN_PHONE.lstrip('+')): # .lstrip('+') برای حذف + از شماره در صورت وجود
-            ADMIN_IDS.add(uid)
-        if uid in ADMIN_IDS:
-            return await func(update, context)
-        if update.message:
-            await update.message.reply_text("⛔️ شما ادمین نیستید و به این بخش دسترسی ندارید.")
-        elif update.callback_query:
-            await update.callback_query.answer("⛔️ شما ادمین نیستید و به این بخش دسترسی ندارید.", show_alert=True)
-    return wrapper
+}
+
+# --- قانون زمان‌بندی دورها ---
+# schedule در پیکربندی یکی از این دو شکل است (زمان‌ها به وقت محلی سرور):
+#   {"cron": "0 0 * * *"}                  مثل crontab: دقیقه ساعت روز ماه روز-هفته (۰ = یکشنبه)
+#   {"every": 86400, "start": 1760000000}  هر every ثانیه، از زمان start
+# و اختیاری "window": چند ثانیه بعد از شروع هر دور /spin باز است (بدون آن تا شروع دور بعد).
+# round_window وضعیت دور فعلی است: {"opens": زمان شروع، "closes": زمان بسته شدن یا null}.
+CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+def parse_duration(text):
+    # "90"، "45m"، "20h"، "1d" -> ثانیه
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if text[-1:] in units:
+        return int(text[:-1]) * units[text[-1]]
+    return int(text)
+
+@lru_cache(maxsize=32)
+def parse_cron(expr):
+    parts = expr.split()
+    if len(parts) != 5:
+        raise ValueError(f"cron needs 5 fields: {expr!r}")
+    fields = []
+    for part, (lo, hi) in zip(parts, CRON_RANGES):
+        values = set()
+        for item in part.split(","):
+            span, _, step = item.partition("/")
+            step = int(step) if step else 1
+            if span == "*":
+                a, b = lo, hi
+            elif "-" in span:
+                a, b = map(int, span.split("-"))
+            else:
+                a = b = int(span)
+                if step > 1: # "5/15" یعنی از ۵ تا آخر، هر ۱۵
+                    b = hi
+            if not lo <= a <= b <= hi or step < 1:
+                raise ValueError(f"bad cron field {item!r}")
+            values.update(range(a, b + 1, step))
+        fields.append(values)
+    fields[4] = {d % 7 for d in fields[4]} # ۷ هم یکشنبه است
+    return (*fields, parts[2] != "*", parts[4] != "*")
+
+def cron_next(expr, after):
+    minutes, hours, days, months, weekdays, by_day, by_weekday = parse_cron(expr)
+    t = datetime.fromtimestamp(after).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    day = t.date()
+    for _ in range(366 * 5):
+        if day.month in months:
+            dom, dow = day.day in days, (day.weekday() + 1) % 7 in weekdays
+            # مثل cron: اگر هر دو محدود شده باشند، یکی کافی است
+            if (dom or dow) if by_day and by_weekday else (dom and dow):
+                for h in sorted(hours):
+                    for m in sorted(minutes):
+                        if day == t.date() and (h, m) < (t.hour, t.minute):
+                            continue
+                        return datetime.combine(day, dtime(h, m)).timestamp()
+        day += timedelta(days=1)
+    return None
+
+def schedule_next(schedule, after):
+    # اولین زمان شروع دور بعد از after
+    if "cron" in schedule:
+        return cron_next(schedule["cron"], after)
+    start, every = schedule.get("start", 0), schedule["every"]
+    if after < start:
+        return start
+    return start + (math.floor((after - start) / every) + 1) * every
+
+def schedule_latest(schedule, after, now):
+    # آخرین زمان شروعی که بعد از after و تا now رسیده (برای جبران دورهای عقب‌افتاده بعد از خاموشی)؛ یا None
+    if "every" in schedule:
+        due = schedule_next(schedule, after)
+        return None if due > now else due + math.floor((now - due) / schedule["every"]) * schedule["every"]
+    latest, due = None, schedule_next(schedule, after)
+    while due is not None and due <= now:
+        latest, due = due, cron_next(schedule["cron"], due)
+    return latest
+
+def check_schedule(schedule):
+    if not isinstance(schedule, dict) or ("cron" in schedule) == ("every" in schedule):
+        raise ValueError("schedule needs exactly one of 'cron' or 'every'")
+    if "cron" in schedule:
+        if not isinstance(schedule["cron"], str):
+            raise ValueError("schedule.cron must be a string")
+        parse_cron(schedule["cron"])
+    elif not isinstance(schedule["every"], int) or schedule["every"] < 60:
+        raise ValueError("schedule.every must be at least 60 seconds")
+    if not isinstance(schedule.get("start", 0), (int, float)):
+        raise ValueError("schedule.start must be a unix timestamp")
+    if schedule.get("window") is not None and (not isinstance(schedule["window"], int) or schedule["window"] <= 0):
+        raise ValueError("schedule.window must be a positive number of seconds")
+
+def format_duration(seconds):
+    for unit, size in (("روز", 86400), ("ساعت", 3600), ("دقیقه", 60)):
+        if seconds >= size and seconds % size == 0:
+            return f"{seconds // size} {unit}"
+    return f"{seconds} ثانیه"
+
+# --- snapshot فقط‌خواندنی پیکربندی ---
+# هندلرها هیچ‌وقت پیکربندی را در جا تغییر نمی‌دهند: هر تغییر (پنل ادمین، ویرایش دستی config.json، worker دیگر)
+# یک snapshot جدید با version بزرگ‌تر می‌سازد که با install_config یک‌جا جایگزین متغیر سراسری config می‌شود.
+# پس هر کد بدون await بین خواندن‌هایش (مثل قرعه در spin) همیشه یک نسخه سازگار می‌بیند و نیازی به قفل نیست.
+# خواندن مثل قبل با config["..."] است؛ جوایز tuple ای از MappingProxyType اند.
+def validate_config(cfg):
+    # ساختار پیکربندی خوانده‌شده از فایل (مثلاً بعد از ویرایش دستی)؛ در صورت خطا ValueError
+    if not isinstance(cfg, dict) or not isinstance(cfg.get("prizes"), list):
+        raise ValueError("config must be an object with a 'prizes' list")
+    for p in cfg["prizes"]:
+        if not isinstance(p, dict) or not isinstance(p.get("name"), str) or not p["name"].strip():
+            raise ValueError(f"prize without a name: {p!r}")
+        if not isinstance(p.get("weight"), int) or p["weight"] < 0:
+            raise ValueError(f"prize {p['name']!r}: weight must be a non-negative integer")
+        if p.get("stock") is not None and (not isinstance(p["stock"], int) or p["stock"] < 0):
+            raise ValueError(f"prize {p['name']!r}: stock must be a non-negative integer")
+    if not isinstance(cfg.get("current_round"), int) or cfg["current_round"] < 1:
+        raise ValueError("current_round must be a positive integer")
+    if not isinstance(cfg.get("channel_username", ""), str):
+        raise ValueError("channel_username must be a string")
+    if not isinstance(cfg.get("version", 0), int) or cfg.get("version", 0) < 0:
+        raise ValueError("version must be a non-negative integer")
+    if cfg.get("schedule") is not None:
+        check_schedule(cfg["schedule"])
+    window = cfg.get("round_window")
+    if window is not None and (not isinstance(window, dict) or not isinstance(window.get("opens"), (int, float))):
+        raise ValueError("round_window needs an 'opens' timestamp")
+    if window is not None and not isinstance(window.get("closes", 0) or 0, (int, float)):
+        raise ValueError("round_window.closes must be a timestamp or null")
+    return cfg
+
+class ConfigSnapshot:
+    __slots__ = ("version", "prizes", "current_round", "channel_username", "schedule", "round_window")
+
+    def __init__(self, cfg):
+        set_ = object.__setattr__
+        set_(self, "version", int(cfg.get("version", 0)))
+        set_(self, "prizes", tuple(MappingProxyType(dict(p)) for p in cfg["prizes"]))
+        set_(self, "current_round", int(cfg["current_round"]))
+        set_(self, "channel_username", cfg.get("channel_username") or "")
+        for key in ("schedule", "round_window"): # None یا dict (فقط‌خواندنی)
+            set_(self, key, MappingProxyType(dict(cfg[key])) if cfg.get(key) else None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ConfigSnapshot is immutable; use commit_config")
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def as_dict(self):
+        # شکل ذخیره‌شده (config.json / جدول‌های SQLite)
+        return {"prizes": [dict(p) for p in self.prizes], "current_round": self.current_round,
+                "channel_username": self.channel_username, "version": self.version,
+                "schedule": dict(self.schedule) if self.schedule else None,
+                "round_window": dict(self.round_window) if self.round_window else None}
+
+    def replace(self, **changes):
+        return ConfigSnapshot({**self.as_dict(), **changes, "version": self.version + 1})
+
+    def same_content(self, other):
+        return {**self.as_dict(), "version": 0} == {**other.as_dict(), "version": 0}
+
+# --- آمار تجمعی چرخش‌ها ---
+# rounds[round] = {"spins": n, "wins": {prize: n}, "draws": {dist: n}}؛ dists[dist] = {prize: احتمال} توزیع نمونه‌گیری
+# که چرخش با آن انجام شده. توزیع مورد انتظار هر دور = Σ draws[dist] × dists[dist]، پس هر چرخش فقط چند شمارنده را
+# زیاد می‌کند. participants تعداد کاربرانی است که حداقل یک بار چرخانده‌اند.
+def empty_spin_stats():
+    return {"rounds": {}, "dists": {}, "participants": 0}
+
+def apply_spin(stats, event):
+    if "dist" in event: # ثبت یک توزیع جدید
+        stats["dists"][event["dist"]] = event["probs"]
+        return
+    rnd = stats["rounds"].setdefault(str(event["r"]), {"spins": 0, "wins": {}, "draws": {}})
+    rnd["spins"] += 1
+    rnd["wins"][event["p"]]  = rnd["wins"].get(event["p"], 0) + 1
+    rnd["draws"][event["s"]] = rnd["draws"].get(event["s"], 0) + 1
+    stats["participants"] += event["n"]
+
+# --- لایه ذخیره‌سازی ---
+# هر دو پیاده‌سازی (JsonStore و SqliteStore) این متدها را دارند و هندلرها فقط با آن‌ها کار می‌کنند:
+#   get_user / update_user / iter_users / count_users / find_by_phone
+#   load_config / save_config / start_round / record_spin(event) / close
+#   claim_spin / config_version
+#   load_stock_used / claim_stock / load_roles / save_role
+#   load_broadcast / save_broadcast
+#   load_conversations / save_conversation / load_user_data / save_user_data
+#   load_spin_stats / save_dist
+# انتخاب پیاده‌سازی با متغیر محیطی STORAGE انجام می‌شود (json یا sqlite).
+
+# --- کلید مکالمه‌های ConversationHandler (مثل (chat_id, user_id)) به صورت "chat_id,user_id" ذخیره می‌شود ---
+def conversation_key(text):
+    return tuple(map(int, text.split(",")))
+
+# --- ژورنال کلید/مقدار برای وضعیت مکالمه‌ها و user_data (حالت JSON) ---
+# هر تغییر یک خط «فضا<TAB>کلید<TAB>مقدار JSON» است (مقدار null یعنی حذف) و آخرین خط هر کلید معتبر است.
+# فضا جدا می‌کند که کلید مال کدام مکالمه یا user_data است؛ در شروع فقط خطوط جدا می‌شوند و مقدارها
+# تا وقتی لازم نشوند parse نمی‌شوند.
+# وقتی خطوط کهنه از خطوط زنده بیشتر شوند، ترد نوشتن فایل را فقط با خطوط زنده از نو می‌نویسد.
+class StateJournal:
+    def __init__(self, path):
+        self.path    = path
+        self.values  = {}   # space -> {key -> مقدار به صورت متن JSON} (رشته‌ها تغییرناپذیرند تا ترد نوشتن بی‌خطر کپی کند)
+        self.garbage = 0    # خطوط کهنه در فایل
+        self._buf  = deque()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"): # خط آخر نیمه‌کاره
+                        break
+                    space, key, value = line[:-1].split("\t", 2)
+                    self._apply(space, key, value)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def _apply(self, space, key, value):
+        values = self.values.setdefault(space, {})
+        if key in values:
+            self.garbage += 1
+        if value == "null":
+            values.pop(key, None)
+            self.garbage += 1
+        else:
+            values[key] = value
+
+    def get(self, space, key):
+        value = self.values.get(space, {}).get(key)
+        return json.loads(value) if value is not None else None
+
+    def items(self, space):
+        for key, value in list(self.values.get(space, {}).items()):
+            yield key, json.loads(value)
+
+    def set(self, space, key, value):
+        value = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        self._apply(space, key, value)
+        self._buf.append(f"{space}\t{key}\t{value}\n")
+        writer.mark(self.path, self._flush)
+
+    def _flush(self, durable=False):
+        # در ترد نوشتن اجرا می‌شود
+        with self._lock:
+            lines = drain(self._buf)
+            if self.garbage > sum(map(len, self.values.values())) + COMPACT_EVERY:
+                self._rewrite()
+            else:
+                self.file.write("".join(lines))
+                self.file.flush()
+            if durable:
+                os.fsync(self.file.fileno())
+
+    def _rewrite(self):
+        # خطوطی که بعد از گرفتن بافر اضافه شده‌اند ممکن است دو بار نوشته شوند؛ تکرار یک مقدار بی‌خطر است
+        live = [(space, list(values.items())) for space, values in list(self.values.items())]
+        self.garbage = 0
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for space, items in live:
+                f.write("".join(f"{space}\t{key}\t{value}\n" for key, value in items))
+            f.flush()
+            os.fsync(f.fileno())
+        self.file.close()
+        os.replace(tmp, self.path)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        self._flush(durable=True)
+        self.file.close()
+
+# --- جدول فشرده کاربران روی دیسک (حالت JSON) ---
+# users.tbl یک فایل است: هر کاربر یک خط JSON (فقط فیلدهایش)، مرتب بر اساس uid (به صورت رشته، همان ترتیبی
+# که iter_users(after=...) و SQLite دارند)، بعد آرایه uidها و آرایه offset خط‌ها (int64) و در آخر یک footer.
+# فایل با mmap باز می‌شود: باز کردن آن مستقل از تعداد کاربران است، جستجوی uid جستجوی دودویی روی آرایه است
+# و فقط خط همان کاربر (وقتی اولین بار لازم شد) parse می‌شود. فایل فقط یک‌جا با os.replace عوض می‌شود.
+def encode_user(data):
+    return (json.dumps(data, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+
+class UserTable:
+    MAGIC  = b"WHEELTB1"
+    FOOTER = struct.Struct("<qq8s") # تعداد کاربران، شروع آرایه‌ها، MAGIC
+
+    def __init__(self, path):
+        self.map     = None
+        self.uids    = memoryview(b"").cast("q")
+        self.offsets = memoryview(bytes(8)).cast("q")
+        if os.path.exists(path) and os.path.getsize(path) >= self.FOOTER.size:
+            with open(path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            n, start, magic = self.FOOTER.unpack_from(self.map, len(self.map) - self.FOOTER.size)
+            if magic != self.MAGIC:
+                raise ValueError(f"{path} is not a user table")
+            view = memoryview(self.map)
+            self.uids    = view[start:start + 8 * n].cast("q")
+            self.offsets = view[start + 8 * n:start + 16 * n + 8].cast("q")
+
+    def __len__(self):
+        return len(self.uids)
+
+    def uid(self, i):
+        return str(self.uids[i])
+
+    def find(self, uid):
+        i = bisect.bisect_left(self.uids, uid, key=str)
+        return i if i < len(self.uids) and str(self.uids[i]) == uid else -1
+
+    def after(self, uid):
+        return bisect.bisect_right(self.uids, uid, key=str)
+
+    def line(self, i):
+        return self.map[self.offsets[i]:self.offsets[i + 1]]
+
+    def get(self, uid):
+        i = self.find(uid)
+        return json.loads(self.line(i)) if i >= 0 else None
+
+    def search(self, needle):
+        # ردیف‌هایی که خطشان needle را دارد؛ جستجو روی کل فایل با mmap.find (بدون parse)
+        rows, end = [], self.offsets[len(self.uids)]
+        pos = self.map.find(needle, 0, end) if self.map is not None else -1
+        while pos >= 0:
+            i = bisect.bisect_right(self.offsets, pos) - 1
+            rows.append(i)
+            pos = self.map.find(needle, self.offsets[i + 1], end)
+        return rows
+
+    @classmethod
+    def write(cls, path, rows):
+        # rows: (uid، خط کدشده با encode_user) به ترتیب رشته‌ای uid
+        uids, offsets, pos = array("q"), array("q"), 0
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            for uid, line in rows:
+                uids.append(int(uid))
+                offsets.append(pos)
+                f.write(line)
+                pos += len(line)
+            offsets.append(pos)
+            f.write(bytes(-pos % 8))
+            start = pos + (-pos % 8)
+            f.write(uids.tobytes())
+            f.write(offsets.tobytes())
+            f.write(cls.FOOTER.pack(len(uids), start, cls.MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+# --- ذخیره‌سازی JSON: snapshot + ژورنال فقط‌افزودنی ---
+# هر تغییر فقط یک خط کوچک به انتهای ژورنال اضافه می‌کند (هزینه ثابت، مستقل از تعداد کاربران).
+# snapshot کاربران جدول users.tbl است (UserTable). در شروع برنامه فقط ژورنال (حداکثر COMPACT_EVERY خط) روی آن
+# اعمال می‌شود؛ بقیه کاربران با اولین دسترسی از جدول خوانده می‌شوند. self.users فقط کاربران خوانده‌شده یا
+# تغییرکرده را نگه می‌دارد و self.dirty کاربرانی را که تغییرشان هنوز در جدول نیست.
+# ادغام (compaction) در پس‌زمینه انجام می‌شود: ژورنال چرخانده می‌شود و جدول جدید در یک ترد از روی جدول قبلی
+# (خط‌های تغییرنکرده بدون parse کپی می‌شوند) و تغییرات ساخته و با os.replace جایگزین می‌شود.
+class JsonStore:
+    def __init__(self, snapshot_path, journal_path, config_path, stock_path, roles_path, broadcast_path, state_path,
+                 spins_path, stats_path, legacy_path=None):
+        self.snapshot_path = snapshot_path
+        self.journal_path  = journal_path
+        self.config_path   = config_path
+        self.stock_path    = stock_path
+        self.roles_path    = roles_path
+        self.broadcast_path = broadcast_path
+        self.state   = StateJournal(state_path)
+        self.spins_path = spins_path
+        self.stats_path = stats_path
+        self._load_spins()
+        self.stock   = load_json(stock_path, {}) # {round: {prize_name: used}}
+        self.roles   = load_json(roles_path, {}) # {uid: role}
+        self.rotated_path  = journal_path + ".1" # ژورنال قدیمی در حین ادغام
+        if legacy_path and not os.path.exists(snapshot_path) and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+        self.table   = UserTable(snapshot_path)
+        self.users   = {}       # uid -> dict کاربرانی که خوانده یا تغییر داده شده‌اند
+        self.dirty   = set()    # کاربرانی که تغییرشان هنوز در جدول نیست
+        self.added   = set()    # کاربرانی که اصلاً در جدول نیستند
+        self.pending = 0    # تعداد تغییرات ادغام‌نشده
+        self._compacting = None
+        self._buf  = deque() # خطوط ژورنال که هنوز روی دیسک نرفته‌اند
+        self._lock = threading.Lock() # بین ترد نوشتن ژورنال و چرخاندن آن
+        for path in (self.rotated_path, self.journal_path):
+            self._replay(path)
+        self.journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _replay(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError: # خط آخر نیمه‌کاره (قطع برنامه وسط نوشتن) نادیده گرفته می‌شود
+                    break
+                self._user(rec["u"], create=True).update(rec["s"])
+                self.dirty.add(rec["u"])
+                self.pending += 1
+
+    def _import_legacy(self, legacy_path):
+        # users.json قدیمی (یک dict بزرگ) فقط یک بار به جدول تبدیل می‌شود؛ بعد از آن دیگر خوانده نمی‌شود
+        legacy = load_json(legacy_path, {})
+        UserTable.write(self.snapshot_path, ((uid, encode_user(data)) for uid, data in sorted(legacy.items())))
+        print(f"Converted {len(legacy)} users from {legacy_path} to {self.snapshot_path}")
+
+    # --- کاربران ---
+    def _user(self, uid, create=False):
+        data = self.users.get(uid)
+        if data is None:
+            data = self.table.get(uid)
+            if data is None:
+                if not create:
+                    return None
+                data = {}
+                self.added.add(uid)
+            self.users[uid] = data
+        return data
+
+    def get_user(self, uid):
+        return self._user(uid) or {}
+
+    def update_user(self, uid, **fields):
+        self._user(uid, create=True).update(fields)
+        self.dirty.add(uid)
+        self._buf.append(json.dumps({"u": uid, "s": fields}, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self.pending += 1
+        writer.mark("journal", self._flush_journal)
+        if self.pending >= COMPACT_EVERY and self._compacting is None:
+            self._compacting = asyncio.get_running_loop().create_task(self.compact())
+
+    def iter_users(self, round=None, after=None):
+        # به ترتیب uid (با after فقط بعد از آن، برای ادامه دادن از یک نقطه). کاربرانی که در حافظه نیستند
+        # فقط parse می‌شوند و در self.users نمی‌مانند؛ با round، خط‌هایی که آن دور را ندارند اصلاً parse نمی‌شوند.
+        table = self.table # اگر وسط پیمایش ادغام تمام شود، همین جدول تا آخر استفاده می‌شود
+        start = 0 if after is None else table.after(after)
+        # خروجی گزارش این پیمایش را در ترد executor انجام می‌دهد، در حالی که هندلرها روی حلقه رویداد به added
+        # اضافه می‌کنند؛ پس همین حالا (نه با اولین next) یک کپی از آن گرفته می‌شود. tuple(set) یک قدم در C است.
+        added = sorted(uid for uid in tuple(self.added) if after is None or uid > after)
+        return self._iter_rows(table, start, added, round)
+
+    def _iter_rows(self, table, start, added, round):
+        needle = f'"round":{round}'.encode() if round is not None else None
+        rows = ((table.uid(i), i) for i in range(start, len(table)))
+        if added:
+            rows = heapq.merge(rows, ((uid, -1) for uid in added))
+        for uid, i in rows:
+            data = self.users.get(uid)
+            if data is None and i < 0: # کاربر تازه‌ای که ادغامی وسط پیمایش او را به جدول جدید برده و از حافظه خارج کرده
+                data = self.table.get(uid)
+                if data is None:
+                    continue
+            elif data is None:
+                line = table.line(i)
+                if needle is not None and needle not in line:
+                    continue
+                data = json.loads(line)
+            if round is None or data.get("round") == round:
+                yield uid, data
+
+    def count_users(self):
+        return len(self.table) + len(self.added)
+
+    def find_by_phone(self, phone):
+        phone = phone.lstrip('+')
+        found = {uid for uid, data in self.users.items() if data.get("phone", "").lstrip('+') == phone}
+        # یک بار جستجوی «شماره"» در کل جدول، بعد بررسی اینکه واقعاً مقدار فیلد phone (با یا بدون +) باشد
+        for i in self.table.search(f'{phone}"'.encode()):
+            uid = self.table.uid(i)
+            if uid not in self.users and (json.loads(self.table.line(i)).get("phone") or "").lstrip('+') == phone:
+                found.add(uid) # نسخه حافظه (در صورت وجود) معتبرتر است و بالا بررسی شده
+        return sorted(found)
+
+    # --- پیکربندی و دورها ---
+    def load_config(self, default):
+        return load_json(self.config_path, default)
+
+    def save_config(self, cfg):
+        copy = json.loads(json.dumps(cfg)) # کپی، تا ترد نوشتن نسخه ثابتی ببیند
+        writer.mark("config", lambda: save_json(self.config_path, copy))
+
+    def start_round(self, cfg):
+        self.save_config(cfg)
+
+    def config_version(self):
+        return 0 # فقط یک پروسه از فایل‌های JSON استفاده می‌کند
+
+    def claim_spin(self, uid, round):
+        # «هر کاربر یک چرخش در هر دور»: بررسی و ثبت دور بدون await بین آن‌ها
+        if (self._user(uid) or {}).get("round", 0) >= round:
+            return False
+        self.update_user(uid, round=round)
+        return True
+
+    # --- تاریخچه و آمار چرخش‌ها ---
+    # هر چرخش یک خط در spins.jsonl است. stats.json آمار تجمعی را همراه با offset (بایت) همان نقطه از
+    # spins.jsonl نگه می‌دارد؛ در شروع فقط خطوط بعد از آن offset دوباره اعمال می‌شوند، نه کل تاریخچه.
+    def _load_spins(self):
+        snapshot = load_json(self.stats_path, {})
+        self.spin_stats  = snapshot.get("stats") or empty_spin_stats()
+        size = os.path.getsize(self.spins_path) if os.path.exists(self.spins_path) else 0
+        self.spins_bytes = min(snapshot.get("offset", 0), size) # انتهای منطقی فایل (شامل خطوط بافرشده)
+        self.since_stats = 0
+        self._spins_buf  = deque()
+        if size:
+            with open(self.spins_path, "rb") as f:
+                f.seek(self.spins_bytes)
+                for line in f:
+                    if not line.endswith(b"\n"): # خط آخر نیمه‌کاره
+                        break
+                    apply_spin(self.spin_stats, json.loads(line))
+                    self.spins_bytes += len(line)
+                    self.since_stats += 1
+        self.spins_log = open(self.spins_path, "ab")
+        if size > self.spins_bytes:
+            self.spins_log.truncate(self.spins_bytes)
+
+    def load_spin_stats(self):
+        return self.spin_stats # همان dict زنده؛ SpinStats مستقیم آن را به‌روز می‌کند
+
+    def save_dist(self, key, probs):
+        self._append_spin({"dist": key, "probs": probs})
+
+    def record_spin(self, event):
+        self._append_spin(event)
+        self.since_stats += 1
+        if self.since_stats >= COMPACT_EVERY:
+            self._save_stats()
+
+    def _append_spin(self, event):
+        line = (json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+        self._spins_buf.append(line)
+        self.spins_bytes += len(line)
+        writer.mark("spins", self._flush_spins)
+
+    def _flush_spins(self):
+        # در ترد نوشتن اجرا می‌شود
+        lines = drain(self._spins_buf)
+        self.spins_log.write(b"".join(lines))
+        self.spins_log.flush()
+
+    def _save_stats(self):
+        copy = json.loads(json.dumps({"offset": self.spins_bytes, "stats": self.spin_stats})) # کپی برای ترد نوشتن
+        self.since_stats = 0
+        writer.mark("stats", lambda: save_json(self.stats_path, copy))
+
+    # --- موجودی جوایز ---
+    def load_stock_used(self, round):
+        return dict(self.stock.get(str(round), {}))
+
+    def claim_stock(self, round, prize, limit):
+        # یک واحد از موجودی برداشته می‌شود؛ خروجی تعداد مصرف‌شده جدید، یا None اگر تمام شده باشد
+        used = self.stock.setdefault(str(round), {}).get(prize, 0)
+        if used >= limit:
+            return None
+        self.stock[str(round)][prize] = used + 1
+        copy = json.loads(json.dumps(self.stock))
+        writer.mark("stock", lambda: save_json(self.stock_path, copy))
+        return used + 1
+
+    # --- نقش‌ها ---
+    def load_roles(self):
+        return dict(self.roles)
+
+    def save_role(self, uid, role):
+        if role is None:
+            self.roles.pop(uid, None)
+        else:
+            self.roles[uid] = role
+        copy = dict(self.roles)
+        writer.mark("roles", lambda: save_json(self.roles_path, copy))
+
+    # --- اطلاع‌رسانی همگانی ---
+    def load_broadcast(self):
+        return load_json(self.broadcast_path, {})
+
+    def save_broadcast(self, state):
+        copy = dict(state)
+        writer.mark("broadcast", lambda: save_json(self.broadcast_path, copy))
+
+    # --- وضعیت مکالمه‌ها و user_data ---
+    def load_conversations(self, name):
+        return {conversation_key(key): state for key, state in self.state.items(f"c:{name}")}
+
+    def save_conversation(self, name, key, state):
+        self.state.set(f"c:{name}", ",".join(map(str, key)), state)
+
+    def load_user_data(self, uid):
+        return self.state.get("u", str(uid)) or {}
+
+    def save_user_data(self, uid, data):
+        self.state.set("u", str(uid), data or None)
+
+    # --- نوشتن و ادغام ژورنال ---
+    def _flush_journal(self, durable=False):
+        # در ترد نوشتن اجرا می‌شود
+        with self._lock:
+            lines = drain(self._buf)
+            self.journal.write("".join(lines))
+            self.journal.flush()
+            if durable:
+                os.fsync(self.journal.fileno())
+
+    def _rotate(self):
+        # ژورنال فعلی کنار گذاشته می‌شود و تغییرات بعدی در ژورنال تازه نوشته می‌شوند.
+        # خطوطی که هنوز در بافر مانده‌اند بعداً در ژورنال تازه نوشته می‌شوند؛ چون هر خط مقدار نهایی
+        # فیلدها را دارد، اعمال دوباره‌شان روی snapshot جدید بی‌خطر است.
+        with self._lock:
+            self.journal.close()
+            if os.path.exists(self.rotated_path): # ادغام قبلی نیمه‌کاره مانده؛ محتوایش در حافظه هست
+                with open(self.rotated_path, "a", encoding="utf-8") as old, open(self.journal_path, "r", encoding="utf-8") as cur:
+                    old.write(cur.read())
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.rotated_path)
+            self.journal = open(self.journal_path, "a", encoding="utf-8")
+        self.pending = 0
+        changes, self.dirty = {uid: encode_user(self.users[uid]) for uid in self.dirty}, set()
+        return self.table, changes
+
+    def _write_snapshot(self, data):
+        # در ترد نوشتن: جدول قبلی و تغییرات (هر دو به ترتیب uid) در هم ادغام می‌شوند
+        table, changes = data
+        def rows():
+            new = iter(sorted(uid for uid in changes if table.find(uid) < 0))
+            pending = next(new, None)
+            for i in range(len(table)):
+                uid = table.uid(i)
+                while pending is not None and pending < uid:
+                    yield pending, changes[pending]
+                    pending = next(new, None)
+                yield uid, changes.get(uid) or table.line(i)
+            while pending is not None:
+                yield pending, changes[pending]
+                pending = next(new, None)
+        UserTable.write(self.snapshot_path, rows())
+        os.remove(self.rotated_path)
+
+    async def compact(self):
+        try:
+            data = self._rotate()
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write_snapshot, data)
+            except Exception:
+                self.dirty.update(data[1]) # دفعه بعد دوباره در جدول نوشته می‌شوند
+                raise
+            # کاربرانی که از زمان چرخاندن ژورنال تغییر نکرده‌اند از حافظه خارج می‌شوند (در جدول جدید هستند)
+            self.table = UserTable(self.snapshot_path)
+            self.users = {uid: data for uid, data in self.users.items() if uid in self.dirty}
+            self.added = {uid for uid in self.added if self.table.find(uid) < 0}
+        finally:
+            self._compacting = None
+
+    async def close(self):
+        # ادغام نهایی هنگام خاموش شدن ربات
+        if self._compacting is not None:
+            await self._compacting
+        self._flush_journal(durable=True)
+        if self.pending:
+            self._write_snapshot(self._rotate())
+        self.journal.close()
+        self.state.close()
+        self._flush_spins()
+        self.spins_log.close()
+        save_json(self.stats_path, {"offset": self.spins_bytes, "stats": self.spin_stats})
+
+# --- ذخیره‌سازی SQLite (حالت WAL) ---
+# کاربران در حافظه نگه داشته نمی‌شوند؛ هر نوشتن فقط یک سطر را تغییر می‌دهد.
+# جستجو با uid (کلید اصلی)، شماره تلفن و دور ایندکس دارد.
+# نوشتن‌ها داخل یک تراکنش باز انجام می‌شوند (همان اتصال بلافاصله آن‌ها را می‌بیند) و COMMIT
+# توسط writer در thread pool انجام می‌شود؛ یعنی چند تغییر پشت سر هم با یک commit روی دیسک می‌روند.
+USER_COLUMNS = {   # ستون‌های جدول users (ستون‌های جدید خودکار با ALTER TABLE اضافه می‌شوند)
+    "phone":      "TEXT",
+    "name":       "TEXT",
+    "round":      "INTEGER",
+    "spin_count": "INTEGER",
+    "last_prize": "TEXT",
+    "last_spin_at": "REAL",
+    "blocked":    "INTEGER", # ۱ یعنی کاربر ربات را مسدود کرده و در اطلاع‌رسانی‌ها نادیده گرفته می‌شود
+}
+PAGE_SIZE = 500 # تعداد سطرهایی که در هر بار پیمایش کاربران خوانده می‌شود
+BUMP_VERSION = ("INSERT INTO meta (key, value) VALUES ('version', 1) "
+                "ON CONFLICT(key) DO UPDATE SET value=CAST(value AS INTEGER)+1", ())
+
+#
+# shared=True (چند پروسه روی یک فایل، حالت WORKERS): به جای تراکنش باز، هر نوشتن یک تراکنش کوتاه
+# BEGIN IMMEDIATE ... COMMIT است تا قفل نوشتن SQLite بین پروسه‌ها فقط چند میکروثانیه نگه داشته شود
+# (در حالت WAL با synchronous=NORMAL، COMMIT بدون fsync است). شرط‌های «یک چرخش در هر دور» و موجودی جوایز
+# با UPDATE ... WHERE شرطی انجام می‌شوند، پس دو پروسه نمی‌توانند یک سهم را با هم بگیرند.
+class SqliteStore:
+    def __init__(self, path, shared=False):
+        # autocommit؛ تراکنش‌ها صریح با BEGIN. اتصال بین حلقه رویداد و ترد commit مشترک است و با lock محافظت می‌شود
+        self.db   = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=10)
+        self.lock = threading.Lock()
+        self.shared = shared
+        self.db.row_factory = sqlite3.Row
+        # چند worker ممکن است همزمان یک فایل تازه را باز کنند: تعویض به WAL وقتی پروسه دیگری فایل را باز کرده
+        # بدون صبر «database is locked» می‌دهد، پس چند بار تکرار می‌شود؛ ساخت جدول‌ها و ستون‌های جدید هم
+        # داخل یک BEGIN IMMEDIATE است تا فقط یک پروسه آن را انجام دهد و بقیه نتیجه را ببینند.
+        for attempt in range(100):
+            try:
+                self.db.execute("PRAGMA journal_mode=WAL")
+                break
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or attempt == 99:
+                    raise
+                time.sleep(0.05)
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self._migrate()
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    SCHEMA = """
+            CREATE TABLE IF NOT EXISTS users  (uid TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS prizes (pos INTEGER PRIMARY KEY, name TEXT NOT NULL, weight INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS stock_used (round INTEGER NOT NULL, prize TEXT NOT NULL, used INTEGER NOT NULL,
+                                                   PRIMARY KEY (round, prize));
+            CREATE TABLE IF NOT EXISTS meta   (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS roles  (uid TEXT PRIMARY KEY, role TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS rounds (round INTEGER PRIMARY KEY, started_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS spins  (id INTEGER PRIMARY KEY, uid TEXT NOT NULL, round INTEGER NOT NULL,
+                                               prize TEXT NOT NULL, ts REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS spins_round ON spins(round);
+            CREATE INDEX IF NOT EXISTS spins_uid   ON spins(uid);
+            CREATE TABLE IF NOT EXISTS conversations (name TEXT NOT NULL, key TEXT NOT NULL, state INTEGER NOT NULL,
+                                                      PRIMARY KEY (name, key));
+            CREATE TABLE IF NOT EXISTS user_data (uid INTEGER PRIMARY KEY, data TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS spin_wins  (round INTEGER NOT NULL, prize TEXT NOT NULL, wins INTEGER NOT NULL,
+                                                   PRIMARY KEY (round, prize));
+            CREATE TABLE IF NOT EXISTS spin_draws (round INTEGER NOT NULL, dist TEXT NOT NULL, draws INTEGER NOT NULL,
+                                                   PRIMARY KEY (round, dist));
+            CREATE TABLE IF NOT EXISTS spin_dists (dist TEXT PRIMARY KEY, probs TEXT NOT NULL);
+    """
+
+    def _add_column(self, table, col, kind):
+        try:
+            self.db.execute(f'ALTER TABLE {table} ADD COLUMN "{col}" {kind}')
+        except sqlite3.OperationalError as e: # ستونی که از قبل هست یعنی کار انجام شده است
+            if "duplicate column" not in str(e):
+                raise
+
+    def _migrate(self):
+        for statement in self.SCHEMA.split(";"): # executescript تراکنش باز را commit می‌کند
+            if statement.strip():
+                self.db.execute(statement)
+        existing = {r["name"] for r in self.db.execute("PRAGMA table_info(users)")}
+        for col, kind in USER_COLUMNS.items():
+            if col not in existing:
+                self._add_column("users", col, kind)
+        if "stock" not in {r["name"] for r in self.db.execute("PRAGMA table_info(prizes)")}:
+            self._add_column("prizes", "stock", "INTEGER") # NULL یعنی بدون محدودیت
+        spin_columns = {r["name"] for r in self.db.execute("PRAGMA table_info(spins)")}
+        if "draw" not in spin_columns:
+            self._add_column("spins", "draw", "REAL")
+            self._add_column("spins", "dist", "TEXT")
+        if "config_version" not in spin_columns:
+            self._add_column("spins", "config_version", "INTEGER")
+        self.db.execute("CREATE INDEX IF NOT EXISTS users_phone ON users(phone)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS users_round ON users(round)")
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def _write(self, *statements):
+        # هر عبارت یک جفت (sql, params) است؛ همه در تراکنش باز فعلی اجرا می‌شوند.
+        # خروجی: تعداد سطرهای تغییرکرده توسط آخرین عبارت (برای UPDATE های شرطی)
+        with self.lock:
+            if self.shared:
+                self.db.execute("BEGIN IMMEDIATE")
+                try:
+                    for sql, params in statements:
+                        cur = self.db.execute(sql, params)
+                    self.db.execute("COMMIT")
+                except BaseException:
+                    self.db.execute("ROLLBACK")
+                    raise
+                return cur.rowcount
+            if not self.db.in_transaction:
+                self.db.execute("BEGIN")
+            for sql, params in statements:
+                cur = self.db.execute(sql, params)
+        writer.mark("sqlite", self._commit)
+        return cur.rowcount
+
+    def _commit(self):
+        # در ترد نوشتن اجرا می‌شود
+        with self.lock:
+            if self.db.in_transaction:
+                self.db.execute("COMMIT")
+
+    # --- کاربران ---
+    def _row(self, row):
+        return {k: row[k] for k in row.keys() if k != "uid" and row[k] is not None}
+
+    def get_user(self, uid):
+        rows = self._query("SELECT * FROM users WHERE uid=?", (uid,))
+        return self._row(rows[0]) if rows else {}
+
+    def update_user(self, uid, **fields):
+        cols = ", ".join(f'"{c}"' for c in fields)
+        sets = ", ".join(f'"{c}"=excluded."{c}"' for c in fields)
+        self._write((f"INSERT INTO users (uid, {cols}) VALUES (?{', ?' * len(fields)}) "
+                     f"ON CONFLICT(uid) DO UPDATE SET {sets}", (uid, *fields.values())))
+
+    def iter_users(self, round=None, after=None):
+        # صفحه به صفحه (بر اساس uid) خوانده می‌شود تا کل جدول یکجا در حافظه نیاید
+        where, params = ("AND round=?", (round,)) if round is not None else ("", ())
+        last = after or ""
+        while True:
+            rows = self._query(f"SELECT * FROM users WHERE uid>? {where} ORDER BY uid LIMIT {PAGE_SIZE}", (last, *params))
+            for row in rows:
+                yield row["uid"], self._row(row)
+            if len(rows) < PAGE_SIZE:
+                return
+            last = rows[-1]["uid"]
+
+    def count_users(self):
+        return self._query("SELECT COUNT(*) FROM users")[0][0]
+
+    def find_by_phone(self, phone):
+        phone = phone.lstrip('+')
+        return [r["uid"] for r in self._query("SELECT uid FROM users WHERE phone IN (?, ?)", (phone, "+" + phone))]
+
+    # --- پیکربندی و دورها ---
+    def load_config(self, default):
+        meta = {r["key"]: r["value"] for r in self._query("SELECT key, value FROM meta")}
+        if "current_round" not in meta:
+            self.save_config(default)
+            return json.loads(json.dumps(default))
+        prizes = [{"name": r["name"], "weight": r["weight"], **({"stock": r["stock"]} if r["stock"] is not None else {})}
+                  for r in self._query("SELECT name, weight, stock FROM prizes ORDER BY pos")]
+        return {
+            "prizes": prizes,
+            "current_round": int(meta["current_round"]),
+            "channel_username": meta.get("channel_username") or "",
+            "version": int(meta.get("config_version") or 0),
+            "schedule": json.loads(meta.get("schedule") or "null"),
+            "round_window": json.loads(meta.get("round_window") or "null"),
+        }
+
+    def save_config(self, cfg):
+        self._write(
+            ("DELETE FROM prizes", ()),
+            *[("INSERT INTO prizes (pos, name, weight, stock) VALUES (?, ?, ?, ?)", (i, p["name"], p["weight"], p.get("stock")))
+              for i, p in enumerate(cfg["prizes"])],
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('current_round', ?)", (str(cfg["current_round"]),)),
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('channel_username', ?)", (cfg["channel_username"],)),
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('config_version', ?)", (str(cfg.get("version", 0)),)),
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('schedule', ?)", (json.dumps(cfg.get("schedule")),)),
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('round_window', ?)", (json.dumps(cfg.get("round_window")),)),
+            BUMP_VERSION,
+        )
+
+    def start_round(self, cfg):
+        self._write(
+            ("INSERT OR REPLACE INTO rounds (round, started_at) VALUES (?, ?)", (cfg["current_round"], time.time())),
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('current_round', ?)", (str(cfg["current_round"]),)),
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('config_version', ?)", (str(cfg.get("version", 0)),)),
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('round_window', ?)", (json.dumps(cfg.get("round_window")),)),
+            BUMP_VERSION,
+        )
+
+    def config_version(self):
+        # با هر تغییر پیکربندی، دور یا نقش‌ها یکی زیاد می‌شود؛ پروسه‌های دیگر با مقایسه آن بارگذاری مجدد می‌کنند
+        rows = self._query("SELECT value FROM meta WHERE key='version'")
+        return int(rows[0]["value"]) if rows else 0
+
+    def claim_spin(self, uid, round):
+        return self._write(
+            ("INSERT OR IGNORE INTO users (uid) VALUES (?)", (uid,)),
+            ("UPDATE users SET round=? WHERE uid=? AND COALESCE(round, 0) < ?", (round, uid, round)),
+        ) == 1
+
+    # --- تاریخچه و آمار چرخش‌ها ---
+    # هر چرخش یک سطر در spins است و شمارنده‌های تجمعی (spin_wins، spin_draws و تعداد شرکت‌کنندگان در meta)
+    # در همان تراکنش با UPSERT یکی زیاد می‌شوند.
+    def record_spin(self, event):
+        self._write(
+            ("INSERT INTO spins (uid, round, prize, ts, draw, dist, config_version) VALUES (?, ?, ?, ?, ?, ?, ?)",
+             (event["u"], event["r"], event["p"], event["t"], event["d"], event["s"], event.get("c"))),
+            ("INSERT INTO spin_wins (round, prize, wins) VALUES (?, ?, 1) "
+             "ON CONFLICT(round, prize) DO UPDATE SET wins=wins+1", (event["r"], event["p"])),
+            ("INSERT INTO spin_draws (round, dist, draws) VALUES (?, ?, 1) "
+             "ON CONFLICT(round, dist) DO UPDATE SET draws=draws+1", (event["r"], event["s"])),
+            *([("INSERT INTO meta (key, value) VALUES ('participants', 1) "
+                "ON CONFLICT(key) DO UPDATE SET value=CAST(value AS INTEGER)+1", ())] if event["n"] else []),
+        )
+
+    def save_dist(self, key, probs):
+        self._write(("INSERT OR IGNORE INTO spin_dists (dist, probs) VALUES (?, ?)", (key, json.dumps(probs, ensure_ascii=False))))
+
+    def load_spin_stats(self):
+        stats = empty_spin_stats()
+        for r in self._query("SELECT round, prize, wins FROM spin_wins"):
+            rnd = stats["rounds"].setdefault(str(r["round"]), {"spins": 0, "wins": {}, "draws": {}})
+            rnd["wins"][r["prize"]] = r["wins"]
+            rnd["spins"] += r["wins"]
+        for r in self._query("SELECT round, dist, draws FROM spin_draws"):
+            stats["rounds"].setdefault(str(r["round"]), {"spins": 0, "wins": {}, "draws": {}})["draws"][r["dist"]] = r["draws"]
+        stats["dists"] = {r["dist"]: json.loads(r["probs"]) for r in self._query("SELECT dist, probs FROM spin_dists")}
+        rows = self._query("SELECT value FROM meta WHERE key='participants'")
+        stats["participants"] = int(rows[0]["value"]) if rows else 0
+        return stats
+
+    # --- موجودی جوایز ---
+    def load_stock_used(self, round):
+        return {r["prize"]: r["used"] for r in self._query("SELECT prize, used FROM stock_used WHERE round=?", (round,))}
+
+    def claim_stock(self, round, prize, limit):
+        if not self._write(
+            ("INSERT OR IGNORE INTO stock_used (round, prize, used) VALUES (?, ?, 0)", (round, prize)),
+            ("UPDATE stock_used SET used=used+1 WHERE round=? AND prize=? AND used<?", (round, prize, limit)),
+        ):
+            return None
+        return self._query("SELECT used FROM stock_used WHERE round=? AND prize=?", (round, prize))[0]["used"]
+
+    # --- نقش‌ها ---
+    def load_roles(self):
+        return {r["uid"]: r["role"] for r in self._query("SELECT uid, role FROM roles")}
+
+    def save_role(self, uid, role):
+        if role is None:
+            self._write(("DELETE FROM roles WHERE uid=?", (uid,)), BUMP_VERSION)
+        else:
+            self._write(("INSERT OR REPLACE INTO roles (uid, role) VALUES (?, ?)", (uid, role)), BUMP_VERSION)
+
+    # --- اطلاع‌رسانی همگانی ---
+    def load_broadcast(self):
+        rows = self._query("SELECT value FROM meta WHERE key='broadcast'")
+        return json.loads(rows[0]["value"]) if rows else {}
+
+    def save_broadcast(self, state):
+        self._write(("INSERT OR REPLACE INTO meta (key, value) VALUES ('broadcast', ?)", (json.dumps(state, ensure_ascii=False),)))
+
+    # --- وضعیت مکالمه‌ها و user_data ---
+    def load_conversations(self, name):
+        return {conversation_key(key): state for key, state in
+                self._query("SELECT key, state FROM conversations WHERE name=?", (name,))}
+
+    def save_conversation(self, name, key, state):
+        key = ",".join(map(str, key))
+        if state is None:
+            self._write(("DELETE FROM conversations WHERE name=? AND key=?", (name, key)))
+        else:
+            self._write(("INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)", (name, key, state)))
+
+    def load_user_data(self, uid):
+        rows = self._query("SELECT data FROM user_data WHERE uid=?", (uid,))
+        return json.loads(rows[0]["data"]) if rows else {}
+
+    def save_user_data(self, uid, data):
+        if data:
+            self._write(("INSERT OR REPLACE INTO user_data (uid, data) VALUES (?, ?)", (uid, json.dumps(data, ensure_ascii=False))))
+        else:
+            self._write(("DELETE FROM user_data WHERE uid=?", (uid,)))
+
+    async def close(self):
+        self._commit()
+        self.db.close()
+
+# --- مهاجرت یک‌باره از فایل‌های JSON به SQLite ---
+# اجرا: python wheel_bot.py migrate
+# کاربران، پیکربندی، نقش‌ها (roles.json)، موجودی مصرف‌شده جوایز (stock.json)، تاریخچه و آمار چرخش‌ها
+# (spins.jsonl/stats.json)، اطلاع‌رسانی نیمه‌کاره (broadcast.json) و وضعیت مکالمه‌ها و user_data (state.journal)
+# منتقل می‌شوند. اگر wheel.db از قبل تاریخچه چرخش داشته باشد، تاریخچه و آمار دوباره اضافه نمی‌شوند.
+def migrate_json_to_sqlite():
+    src = store if isinstance(store, JsonStore) else JsonStore(USERS_TABLE, USERS_LOG, CONFIG_FILE, STOCK_FILE, ROLES_FILE, BROADCAST_FILE, STATE_LOG, SPINS_LOG, STATS_FILE, USERS_FILE)
+    dst = store if isinstance(store, SqliteStore) else SqliteStore(DB_FILE)
+    cfg = src.load_config(DEFAULT_CONFIG)
+    dst.save_config(cfg)
+    count = 0
+    with dst.db:
+        dst.db.execute("BEGIN")
+        for uid, data in src.iter_users():
+            fields = {k: v for k, v in data.items() if k in USER_COLUMNS}
+            cols = ", ".join(f'"{c}"' for c in fields)
+            dst.db.execute(f"INSERT OR REPLACE INTO users (uid{', ' if fields else ''}{cols}) "
+                           f"VALUES (?{', ?' * len(fields)})", (uid, *fields.values()))
+            count += 1
+        roles = src.load_roles()
+        for uid, role in roles.items():
+            dst.db.execute("INSERT OR REPLACE INTO roles (uid, role) VALUES (?, ?)", (uid, role))
+        for round, used in src.stock.items():
+            for prize, n in used.items():
+                dst.db.execute("INSERT OR REPLACE INTO stock_used (round, prize, used) VALUES (?, ?, ?)", (int(round), prize, n))
+        spins = migrate_spins(src, dst)
+        broadcast = src.load_broadcast()
+        if broadcast:
+            dst.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('broadcast', ?)",
+                           (json.dumps(broadcast, ensure_ascii=False),))
+        states = 0
+        for space in list(src.state.values):
+            for key, value in src.state.items(space):
+                if space.startswith("c:"):
+                    dst.db.execute("INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                                   (space[2:], key, value))
+                elif space == "u":
+                    dst.db.execute("INSERT OR REPLACE INTO user_data (uid, data) VALUES (?, ?)",
+                                   (int(key), json.dumps(value, ensure_ascii=False)))
+                states += 1
+    print(f"Migrated {count} users, {len(cfg['prizes'])} prizes, {len(roles)} roles, stock of {len(src.stock)} rounds, "
+          + (f"{spins} spins" if spins is not None else "no spins (wheel.db already has spin history)")
+          + f", {'a pending' if broadcast else 'no'} broadcast and {states} conversation/user_data entries into {DB_FILE}")
+
+def migrate_spins(src, dst):
+    # در تراکنش باز migrate_json_to_sqlite؛ خروجی تعداد چرخش‌های منتقل‌شده یا None اگر رد شده باشد
+    if dst.db.execute("SELECT 1 FROM spins LIMIT 1").fetchone():
+        return None
+    count = 0
+    if os.path.exists(src.spins_path):
+        with open(src.spins_path, "rb") as f:
+            for line in f.read(src.spins_bytes).splitlines(): # تا انتهای منطقی فایل
+                event = json.loads(line)
+                if "dist" in event:
+                    continue # توزیع‌ها از آمار می‌آیند
+                dst.db.execute("INSERT INTO spins (uid, round, prize, ts, draw, dist, config_version) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (event["u"], event["r"], event["p"], event["t"], event.get("d"), event["s"], event.get("c")))
+                count += 1
+    stats = src.load_spin_stats()
+    for round, rnd in stats["rounds"].items():
+        for prize, wins in rnd["wins"].items():
+            dst.db.execute("INSERT OR REPLACE INTO spin_wins (round, prize, wins) VALUES (?, ?, ?)", (int(round), prize, wins))
+        for dist, draws in rnd["draws"].items():
+            dst.db.execute("INSERT OR REPLACE INTO spin_draws (round, dist, draws) VALUES (?, ?, ?)", (int(round), dist, draws))
+    for dist, probs in stats["dists"].items():
+        dst.db.execute("INSERT OR REPLACE INTO spin_dists (dist, probs) VALUES (?, ?)", (dist, json.dumps(probs, ensure_ascii=False)))
+    dst.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('participants', ?)", (str(stats["participants"]),))
+    return count
+
+# --- بارگذاری پیکربندی و اطلاعات کاربران ---
+if STORAGE == "sqlite":
+    store = SqliteStore(DB_FILE, shared=WORKERS > 1)
+else:
+    store = JsonStore(USERS_TABLE, USERS_LOG, CONFIG_FILE, STOCK_FILE, ROLES_FILE, BROADCAST_FILE, STATE_LOG, SPINS_LOG, STATS_FILE, USERS_FILE)
+config = ConfigSnapshot(store.load_config(DEFAULT_CONFIG))
+
+# --- نمونه‌گیر جوایز با روش Alias (Walker/Vose) ---
+# جدول‌ها یک بار از روی لیست جوایز ساخته می‌شوند (O(n)) و هر قرعه O(1) است.
+# فقط وقتی جوایز تغییر می‌کنند (افزودن/ویرایش وزن/حذف) دوباره ساخته می‌شود.
+# rng قابل تعویض است: random.Random(seed) برای تکرارپذیری و ممیزی، random.SystemRandom برای امنیت.
+class PrizeSampler:
+    def __init__(self, prizes, rng, version=0):
+        self.rng    = rng
+        self.version = version # نسخه snapshot پیکربندی که جدول از آن ساخته شده (در تاریخچه چرخش ثبت می‌شود)
+        self.prizes = [p for p in prizes if p.get("weight", 0) > 0] # جوایز بدون وزن یا وزن صفر کنار گذاشته می‌شوند
+        n     = len(self.prizes)
+        total = sum(p["weight"] for p in self.prizes)
+        self.prob  = [1.0] * n
+        self.alias = list(range(n))
+        scaled = [p["weight"] * n / total for p in self.prizes] if n else []
+        # توزیع این نمونه‌گیر و شناسه کوتاهش (برای آمار مورد انتظار در برابر مشاهده‌شده)
+        self.probs = {}
+        for p in self.prizes:
+            self.probs[p["name"]] = self.probs.get(p["name"], 0) + p["weight"] / total
+        self.dist  = hashlib.sha1(json.dumps(sorted(self.probs.items()), ensure_ascii=False).encode()).hexdigest()[:12]
+        small  = [i for i, w in enumerate(scaled) if w < 1.0]
+        large  = [i for i, w in enumerate(scaled) if w >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s], self.alias[s] = scaled[s], l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # باقی‌مانده‌ها (به خاطر خطای اعشاری) احتمال ۱ دارند
+
+    def __len__(self):
+        return len(self.prizes)
+
+    def draw_index(self, u=None):
+        # یک عدد یکنواخت u در [0, 1): بخش صحیح u*n ستون و بخش اعشاری آن سکه ستون است.
+        # u در تاریخچه چرخش‌ها ذخیره می‌شود تا هر نتیجه با همان جدول قابل بازبینی باشد.
+        if u is None:
+            u = self.rng.random()
+        x = u * len(self.prizes)
+        i = int(x)
+        return i if x - i < self.prob[i] else self.alias[i]
+
+    def draw(self, u=None):
+        return self.prizes[self.draw_index(u)]
+
+    def draw_many(self, k):
+        return [self.prizes[self.draw_index()] for _ in range(k)]
+
+def make_rng():
+    return random.Random(int(PRIZE_RNG_SEED)) if PRIZE_RNG_SEED else random.SystemRandom()
+
+# --- موجودی محدود جوایز در هر دور ---
+# جایزه‌ای که فیلد "stock" دارد در هر دور حداکثر همین تعداد بار داده می‌شود (بدون stock = نامحدود).
+# claim بین بررسی و افزایش شمارنده هیچ await ای ندارد؛ پس حتی با پردازش همزمان آپدیت‌ها
+# (concurrent_updates) دو چرخش نمی‌توانند آخرین واحد یک جایزه را با هم بگیرند. شرط نهایی را store.claim_stock
+# می‌گذارد، تا در حالت چند پروسه‌ای (WORKERS) هم موجودی بیش از حد داده نشود.
+class PrizeStock:
+    def __init__(self, round):
+        self.load(round)
+
+    def load(self, round):
+        self.round = round
+        self.used  = store.load_stock_used(round) # {prize_name: used}
+
+    def remaining(self, prize):
+        if prize.get("stock") is None:
+            return None
+        return max(prize["stock"] - self.used.get(prize["name"], 0), 0)
+
+    def claim(self, prize):
+        if prize.get("stock") is None:
+            return True
+        if self.used.get(prize["name"], 0) >= prize["stock"]:
+            return False
+        used = store.claim_stock(self.round, prize["name"], prize["stock"]) # شرط نهایی در store (بین پروسه‌ها)
+        self.used[prize["name"]] = prize["stock"] if used is None else used
+        return used is not None
+
+stock = PrizeStock(config["current_round"])
+
+def available_prizes():
+    return [p for p in config["prizes"] if stock.remaining(p) != 0]
+
+sampler = PrizeSampler(available_prizes(), make_rng(), config.version)
+
+def rebuild_sampler():
+    global sampler
+    sampler = PrizeSampler(available_prizes(), sampler.rng, config.version)
+
+def draw_prize():
+    # قرعه + برداشت از موجودی؛ اگر جایزه‌ای تمام شود نمونه‌گیر بدون آن دوباره ساخته می‌شود.
+    # خروجی: (جایزه، عدد تصادفی قرعه، نمونه‌گیری که قرعه با آن انجام شد) یا None
+    while sampler:
+        used = sampler
+        u = used.rng.random()
+        prize = used.draw(u)
+        if stock.claim(prize):
+            if stock.remaining(prize) == 0:
+                rebuild_sampler()
+            return prize, u, used
+        rebuild_sampler()
+    return None
+
+# --- جایگزینی snapshot پیکربندی ---
+def install_config(new):
+    # بدون await: از دید هندلرها config، موجودی دور و نمونه‌گیر با هم عوض می‌شوند
+    global config
+    old, config = config, new
+    if new.current_round != old.current_round:
+        stock.load(new.current_round) # موجودی جوایز برای دور جدید از نو شمرده می‌شود
+        member_cache.invalidate()     # عضویت در دور جدید دوباره بررسی می‌شود
+    rebuild_sampler()
+    if (new.schedule, new.round_window) != (old.schedule, old.round_window):
+        round_scheduler.reset()
+
+def commit_config(**changes):
+    # تغییرات ادمین: snapshot جدید با نسخه بعدی، ذخیره و جایگزینی
+    new = config.replace(**changes)
+    if new.current_round != config.current_round:
+        store.start_round(new.as_dict())
+    else:
+        store.save_config(new.as_dict())
+    install_config(new)
+    return new
+
+# --- شروع دور جدید (دستی از پنل ادمین یا خودکار با زمان‌بندی) ---
+# کار سنگین تعویض دور (شمردن موجودی دور جدید، ساخت نمونه‌گیر، پاک کردن کش عضویت) همین‌جا در install_config
+# انجام می‌شود؛ با زمان‌بندی، این کار را job در لحظه شروع دور انجام می‌دهد، نه اولین /spin های دور جدید.
+def start_next_round(opens=None):
+    opens = time.time() if opens is None else opens
+    schedule = config.schedule
+    window = None
+    if schedule:
+        window = {"opens": opens, "closes": opens + schedule["window"] if schedule.get("window") else None}
+    return commit_config(current_round=config.current_round + 1, round_window=window)
+
+def round_is_open(cfg, now):
+    window = cfg.round_window
+    return not window or (window["opens"] <= now and (window.get("closes") is None or now < window["closes"]))
+
+def next_round_at(cfg):
+    if not cfg.schedule:
+        return None
+    return schedule_next(cfg.schedule, cfg.round_window["opens"] if cfg.round_window else time.time())
+
+# --- زمان‌بند دورها روی JobQueue ربات ---
+# همیشه فقط یک job یک‌باره برای زمان شروع دور بعد وجود دارد؛ زمان بعدی از روی schedule و round_window.opens
+# (هر دو در پیکربندی ذخیره‌شده) حساب می‌شود، پس بعد از ری‌استارت همان برنامه ادامه پیدا می‌کند. اگر ربات در
+# زمان شروع یک یا چند دور خاموش بوده، job بلافاصله اجرا می‌شود و فقط یک دور جدید با زمان آخرین شروع
+# عقب‌افتاده باز می‌کند (دورهای خالی وسط ساخته نمی‌شوند). در حالت WORKERS فقط worker صفر زمان‌بند دارد.
+class RoundScheduler:
+    def __init__(self):
+        self.job_queue = None
+        self.job = None
+
+    def start(self, app):
+        if app.job_queue is None:
+            if config.schedule:
+                print("Round schedule is set but JobQueue is unavailable; pip install 'python-telegram-bot[job-queue]'")
+            return
+        self.job_queue = app.job_queue
+        self.reset()
+
+    def reset(self):
+        # بعد از هر تغییر schedule یا round_window (از جمله خود تعویض دور)
+        if self.job is not None:
+            self.job.schedule_removal()
+            self.job = None
+        due = next_round_at(config) if self.job_queue is not None else None
+        if due is not None:
+            self.job = self.job_queue.run_once(self._rollover, max(due - time.time(), 0),
+                                               data=(due, config.current_round), name="round_rollover")
+
+    async def _rollover(self, context):
+        self.job = None
+        due, armed_round = context.job.data # زمان شروع و دوری که job برای آن ساخته شده
+        if WORKERS > 1:
+            # worker صفر پیکربندی را فقط با آپدیت‌های خودش تازه می‌کند؛ شاید worker دیگری در این فاصله دور را
+            # عوض یا زمان‌بندی را خاموش کرده باشد (install_config در این صورت خودش job تازه می‌سازد)
+            reload_shared_state()
+        schedule, window = config.schedule, config.round_window
+        if not schedule or self.job is not None:
+            return
+        if config.current_round != armed_round: # دور را کس دیگری عوض کرده؛ فقط job دور بعد ساخته می‌شود
+            self.reset()
+            return
+        if window:
+            opens = schedule_latest(schedule, window["opens"], time.time())
+        else: # مثلاً schedule از ویرایش config.json آمده و round_window ندارد
+            opens = schedule_latest(schedule, due, time.time()) or due
+        if opens is None: # پیکربندی در این فاصله عوض شده است
+            self.reset()
+            return
+        new = start_next_round(opens) # reset از داخل install_config، job دور بعد را می‌سازد
+        print(f"Round {new.current_round} started by schedule at {format_time(opens)}")
+
+round_scheduler = RoundScheduler()
+
+# --- بارگذاری مجدد config.json وقتی بیرون از ربات ویرایش شود (فقط STORAGE=json) ---
+# mtime فایل هر CONFIG_WATCH_INTERVAL ثانیه بررسی می‌شود. فایل نامعتبر (مثلاً نیمه‌نوشته) نادیده گرفته می‌شود
+# تا نوشتن بعدی. نوشته‌های خود ربات هم mtime را عوض می‌کنند: فایلی با نسخه قدیمی‌تر (نوشتن عقب‌مانده) یا همان
+# محتوا کنار گذاشته می‌شود؛ ویرایش دستی با همان نسخه، نسخه بعدی را می‌گیرد و دوباره ذخیره می‌شود.
+class ConfigWatcher:
+    def __init__(self, path, interval):
+        self.path     = path
+        self.interval = interval
+        self.mtime    = self._mtime()
+        self.task     = None
+        self.reloads  = 0
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def start(self):
+        if self.interval > 0 and self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            mtime = self._mtime()
+            if mtime is not None and mtime != self.mtime:
+                self.mtime = mtime
+                self.check()
+
+    def check(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                new = ConfigSnapshot(validate_config(json.load(f)))
+        except (OSError, ValueError) as e:
+            print(f"Ignoring {self.path}: {e}")
+            return
+        except Exception as e: # هر خطای پیش‌بینی‌نشده: snapshot فعلی می‌ماند و task نظارت زنده می‌ماند
+            print(f"Ignoring {self.path}: unexpected {type(e).__name__}: {e}")
+            return
+        if new.version < config.version or new.same_content(config):
+            return
+        if new.version == config.version:
+            new = ConfigSnapshot({**new.as_dict(), "version": config.version + 1})
+            store.save_config(new.as_dict())
+        install_config(new)
+        self.reloads += 1
+        print(f"Reloaded {self.path} (config version {new.version})")
+
+config_watcher = ConfigWatcher(CONFIG_FILE, CONFIG_WATCH_INTERVAL if isinstance(store, JsonStore) else 0)
+
+# --- تاریخچه و آمار چرخش‌ها ---
+class SpinStats:
+    def __init__(self):
+        self.data = store.load_spin_stats() # در حالت JSON همان dict ای است که store از آن snapshot می‌گیرد
+
+    def record(self, uid, round, prize, u, used, first):
+        if used.dist not in self.data["dists"]:
+            event = {"dist": used.dist, "probs": used.probs}
+            apply_spin(self.data, event)
+            store.save_dist(used.dist, used.probs)
+        event = {"u": uid, "r": round, "p": prize["name"], "t": time.time(), "d": u, "s": used.dist, "n": int(first),
+                 "c": used.version}
+        apply_spin(self.data, event)
+        store.record_spin(event)
+        metrics.inc("wheel_prizes_drawn_total", round=round, prize=prize["name"])
+
+    def refresh(self):
+        # حالت WORKERS: شمارنده‌های این پروسه فقط چرخش‌های خودش را دارند؛ جمع همه از store خوانده می‌شود
+        self.data = store.load_spin_stats()
+
+    def round(self, round):
+        return self.data["rounds"].get(str(round))
+
+    def expected(self, round):
+        # {prize: تعداد مورد انتظار} از روی توزیع‌هایی که چرخش‌های این دور با آن‌ها انجام شده‌اند
+        expected = {}
+        for dist, draws in self.round(round)["draws"].items():
+            for prize, p in self.data["dists"].get(dist, {}).items():
+                expected[prize] = expected.get(prize, 0) + draws * p
+        return expected
+
+spin_stats = SpinStats()
+
+# --- شماره تلفن‌ها فقط رقم نگه داشته می‌شوند (بدون +، فاصله و خط تیره) ---
+def normalize_phone(phone):
+    return "".join(ch for ch in phone if ch.isdigit())
+
+ADMIN_PHONE_SET = {normalize_phone(p) for p in ADMIN_PHONES.split(",") if normalize_phone(p)}
+
+def is_admin_phone(phone):
+    # فقط یک بار هنگام ثبت شماره اجرا می‌شود، نه در هر درخواست ادمین
+    return any(phone.endswith(p) for p in ADMIN_PHONE_SET)
+
+# --- ایندکس نقش‌ها (uid -> نقش) ---
+# در شروع برنامه از store خوانده می‌شود و تغییراتش همان لحظه در حافظه و با تأخیر روی دیسک اعمال می‌شود.
+# بررسی دسترسی فقط یک جستجوی dict است. هر نقش دسترسی نقش‌های پایین‌تر را هم دارد.
+ROLE_RANK = {"viewer": 1, "operator": 2, "admin": 3}
+ROLE_TITLES = {"viewer": "👁 بیننده", "operator": "🛠 اپراتور", "admin": "👑 ادمین"}
+
+class RoleIndex:
+    def __init__(self):
+        self.roles = {} # uid (int) -> نقش
+        self.rank  = {} # uid (int) -> رتبه نقش
+
+    def load(self):
+        self.roles = {int(uid): role for uid, role in store.load_roles().items() if role in ROLE_RANK}
+        self.rank  = {uid: ROLE_RANK[role] for uid, role in self.roles.items()}
+
+    def set(self, uid, role):
+        if role is None:
+            self.roles.pop(uid, None)
+            self.rank.pop(uid, None)
+        else:
+            self.roles[uid] = role
+            self.rank[uid]  = ROLE_RANK[role]
+        store.save_role(str(uid), role)
+
+roles = RoleIndex()
+roles.load()
+
+# --- دکوراتور برای محدود کردن دسترسی بر اساس نقش ---
+def require_role(role):
+    need = ROLE_RANK[role]
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(update:Update, context:ContextTypes.DEFAULT_TYPE):
+            # update گاهی خود CallbackQuery است (مثلاً admin_panel(query, context))
+            user = update.effective_user if isinstance(update, Update) else update.from_user
+            if roles.rank.get(user.id, 0) >= need:
+                return await func(update, context)
+            if update.message:
+                await update.message.reply_text("⛔️ شما ادمین نیستید و به این بخش دسترسی ندارید.")
+            elif update.callback_query:
+                await update.callback_query.answer("⛔️ شما ادمین نیستید و به این بخش دسترسی ندارید.", show_alert=True)
+        return wrapper
+    return decorator
+
+admin_only    = require_role("admin")
+operator_only = require_role("operator")
+viewer_only   = require_role("viewer")
+
+# --- محدودیت نرخ ---
+# TokenBucket: برای هر کلید (کاربر، چت یا None برای کل ربات) سطلی با ظرفیت burst که با سرعت rate پر می‌شود.
+# take() اگر توکن باشد آن را برمی‌دارد و 0 برمی‌گرداند؛ وگرنه چند ثانیه تا توکن بعدی مانده است.
+# سطل‌ها به ترتیب آخرین استفاده در OrderedDict هستند: سطل‌های اول صف که دوباره پر شده‌اند (اطلاعاتی ندارند) و
+# اگر بیشتر از RATE_BUCKETS_MAX سطل باشد قدیمی‌ترین‌ها از جلو حذف می‌شوند؛ هر take به طور سرشکن O(1) است.
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate    = rate
+        self.burst   = burst
+        self.buckets = OrderedDict() # key -> (tokens, last_refill)، قدیمی‌ترین استفاده اول
+
+    def _refill(self, key, now):
+        tokens, last = self.buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - last) * self.rate)
+
+    def take(self, key=None):
+        now    = time.monotonic()
+        tokens = self._refill(key, now)
+        if tokens < 1:
+            self._store(key, tokens, now)
+            return (1 - tokens) / self.rate
+        self._store(key, tokens - 1, now)
+        return 0.0
+
+    def _store(self, key, tokens, now):
+        self.buckets[key] = (tokens, now)
+        self.buckets.move_to_end(key)
+        old = next(iter(self.buckets)) # هر بار حداکثر یک سطل از جلو؛ هر take هم حداکثر یکی اضافه می‌کند
+        if len(self.buckets) > RATE_BUCKETS_MAX or self._refill(old, now) >= self.burst:
+            del self.buckets[old]
+
+# --- محدودیت ورودی: /spin های پشت سر هم قبل از هر بررسی عضویت یا I/O رد می‌شوند ---
+spin_user_limit   = TokenBucket(SPIN_USER_RATE, SPIN_USER_BURST)
+spin_global_limit = TokenBucket(SPIN_GLOBAL_RATE, SPIN_GLOBAL_RATE * 2) if SPIN_GLOBAL_RATE else None
+inbound_stats     = {"spin_rejected_user": 0, "spin_rejected_global": 0}
+
+async def spin_gate(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    # در گروه -1 قبل از همه هندلرها اجرا می‌شود؛ فقط دستور /spin را محدود می‌کند
+    message = update.message
+    if not message or not message.text or not message.text.startswith("/spin"):
+        return
+    if spin_user_limit.take(update.effective_user.id):
+        inbound_stats["spin_rejected_user"] += 1
+        raise ApplicationHandlerStop
+    if spin_global_limit and spin_global_limit.take():
+        inbound_stats["spin_rejected_global"] += 1
+        raise ApplicationHandlerStop
+
+# --- صف اولویت‌دار ارسال پیام (محدودیت flood تلگرام) ---
+# همه پیام‌های خروجی ربات از این صف رد می‌شوند: حداکثر SEND_RATE پیام در ثانیه برای کل ربات و
+# CHAT_RATE پیام در ثانیه برای هر چت. پیام کاربران عادی (مثل نتیجه گردونه) جلوتر از پیام ادمین‌ها
+# و پیام‌های انبوه (اطلاع‌رسانی) می‌رود. هر بار که توکن هست، همه پیام‌های آماده یکجا آزاد می‌شوند.
+# اگر تلگرام RetryAfter بدهد، کل صف به همان اندازه صبر می‌کند و پیام دوباره در صف قرار می‌گیرد.
+PRIORITY_USER, PRIORITY_ADMIN, PRIORITY_BULK = 0, 1, 2
+SEND_ENDPOINTS = {"sendMessage", "editMessageText", "sendDocument", "sendPhoto", "sendAnimation",
+                  "copyMessage", "forwardMessage", "editMessageReplyMarkup"}
+SEND_MAX_RETRIES = 3
+
+class SendScheduler(BaseRateLimiter):
+    def __init__(self, rate, chat_rate, chat_burst):
+        self.global_bucket = TokenBucket(rate, rate)
+        self.chat_bucket   = TokenBucket(chat_rate, chat_burst)
+        self.queue  = []                  # heap: (priority, seq, chat_id, future, enqueued_at)
+        self.seq    = 0
+        self.paused_until = 0.0           # پس از RetryAfter
+        self.wakeup = None
+        self._task  = None
+        self.stats  = {"sent": 0, "retries": 0, "max_depth": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    async def initialize(self):
+        if self._task is not None: # Application و Updater هر دو bot را initialize می‌کنند
+            return
+        self.wakeup = asyncio.Event()
+        self._task  = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for entry in self.queue: # پیام‌های منتظر بدون محدودیت رها می‌شوند
+            if not entry[3].done():
+                entry[3].set_result(None)
+        self.queue.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if endpoint not in SEND_ENDPOINTS or chat_id is None:
+            return await callback(*args, **kwargs)
+        if isinstance(rate_limit_args, int):
+            priority = rate_limit_args
+        else:
+            priority = PRIORITY_ADMIN if roles.rank.get(chat_id) else PRIORITY_USER
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            await self._wait_turn(priority, chat_id)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.stats["retries"] += 1
+                self.paused_until = max(self.paused_until, time.monotonic() + e.retry_after)
+                if attempt == SEND_MAX_RETRIES:
+                    raise
+
+    async def _wait_turn(self, priority, chat_id):
+        future = asyncio.get_running_loop().create_future()
+        self.seq += 1
+        heapq.heappush(self.queue, (priority, self.seq, chat_id, future, time.monotonic()))
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self.queue))
+        self.wakeup.set()
+        await future
+
+    def _release_ready(self):
+        # تا وقتی توکن سراسری هست، پیام‌های آماده به ترتیب اولویت آزاد می‌شوند.
+        # خروجی: چند ثانیه تا امکان آزاد کردن پیام بعدی (None یعنی صف خالی است)
+        soonest  = None
+        deferred = []
+        while self.queue:
+            wait = self.global_bucket.take()
+            if wait:
+                soonest = wait
+                break
+            entry = None
+            while self.queue:
+                candidate = heapq.heappop(self.queue)
+                if candidate[3].done(): # فرستنده لغو شده
+                    continue
+                chat_wait = self.chat_bucket.take(candidate[2])
+                if not chat_wait:
+                    entry = candidate
+                    break
+                deferred.append(candidate)
+                soonest = chat_wait if soonest is None else min(soonest, chat_wait)
+            if entry is None:
+                self.global_bucket.buckets[None] = (self.global_bucket.buckets[None][0] + 1, time.monotonic()) # توکن مصرف‌نشده
+                break
+            waited = (time.monotonic() - entry[4]) * 1000
+            self.stats["sent"] += 1
+            self.stats["wait_ms_total"] += waited
+            self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], waited)
+            entry[3].set_result(None)
+        for entry in deferred:
+            heapq.heappush(self.queue, entry)
+        return soonest if self.queue else None
+
+    async def _dispatch(self):
+        while True:
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            self.wakeup.clear()
+            wait = self._release_ready()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), wait) # پیام جدید یا رسیدن توکن
+            except asyncio.TimeoutError:
+                pass
+
+send_scheduler = SendScheduler(SEND_RATE, CHAT_RATE, CHAT_BURST) if SEND_RATE else None
+
+# --- اطلاع‌رسانی همگانی (مثلاً شروع دور جدید) ---
+# گیرنده‌ها به ترتیب uid و دسته‌دسته (BROADCAST_BATCH) از store خوانده می‌شوند؛ هیچ‌وقت کل لیست در حافظه نیست.
+# هر دسته با BROADCAST_WORKERS ارسال همزمان فرستاده می‌شود و با اولویت پایین (PRIORITY_BULK) از صف ارسال
+# رد می‌شود، پس پاسخ /spin کاربران همیشه جلوتر است. بعد از هر دسته، آخرین uid و شمارنده‌ها در store ذخیره
+# می‌شوند؛ اگر ربات وسط کار خاموش شود، در شروع بعدی از همان‌جا ادامه می‌دهد (حداکثر یک دسته دوباره فرستاده می‌شود).
+# کاربرانی که ربات را مسدود کرده‌اند (Forbidden) علامت blocked می‌گیرند و در اطلاع‌رسانی‌های بعدی نادیده گرفته می‌شوند.
+class Broadcaster:
+    def __init__(self):
+        self.state = store.load_broadcast()
+        self.task  = None
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def start(self, bot, text, round):
+        self.state = {"text": text, "round": round, "cursor": "", "status": "running", "started_at": time.time(),
+                      "total": store.count_users(), "done": 0, "sent": 0, "failed": 0, "blocked": 0, "skipped": 0}
+        store.save_broadcast(self.state)
+        self.resume(bot)
+
+    def resume(self, bot):
+        if self.state.get("status") == "running" and not self.running:
+            self.task = asyncio.get_running_loop().create_task(self._run(bot))
+
+    async def cancel(self):
+        await self.stop()
+        if self.state.get("status") == "running":
+            self.state["status"] = "cancelled"
+            store.save_broadcast(self.state)
+
+    async def stop(self):
+        # هنگام خاموش شدن: وضعیت running می‌ماند تا در اجرای بعدی ادامه پیدا کند
+        if self.running:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self, bot):
+        state = self.state
+        users = store.iter_users(after=state["cursor"])
+        while True:
+            batch = list(islice(users, BROADCAST_BATCH))
+            if not batch:
+                break
+            uids = []
+            for uid, data in batch:
+                if data.get("blocked"):
+                    state["skipped"] += 1
+                else:
+                    uids.append(uid)
+            pending = iter(uids)
+            async def worker():
+                for uid in pending: # همه workerها از یک iterator برمی‌دارند
+                    await self._send(bot, uid, state)
+            await asyncio.gather(*(worker() for _ in range(min(BROADCAST_WORKERS, len(uids)))))
+            state["cursor"] = batch[-1][0]
+            state["done"]  += len(batch)
+            store.save_broadcast(state)
+        state["status"] = "done"
+        state["finished_at"] = time.time()
+        store.save_broadcast(state)
+
+    async def _send(self, bot, uid, state):
+        try:
+            if send_scheduler is not None:
+                await bot.send_message(int(uid), state["text"], rate_limit_args=PRIORITY_BULK)
+            else:
+                await bot.send_message(int(uid), state["text"])
+            state["sent"] += 1
+        except Forbidden: # کاربر ربات را مسدود کرده یا حسابش حذف شده
+            store.update_user(uid, blocked=1)
+            state["blocked"] += 1
+        except TelegramError as e:
+            print(f"Broadcast to {uid} failed: {e}")
+            state["failed"] += 1
+
+broadcaster = Broadcaster()
+
+# --- کش عضویت در کانال ---
+# نتیجه get_chat_member برای هر (کانال، کاربر) با TTL جدا برای عضو/غیرعضو نگه داشته می‌شود.
+# اندازه کش محدود است و قدیمی‌ترین ورودی‌ها (LRU) حذف می‌شوند. اگر چند درخواست همزمان برای
+# یک کاربر برسد، همه منتظر همان یک درخواست API می‌مانند.
+class MembershipCache:
+    def __init__(self, pos_ttl, neg_ttl, size):
+        self.pos_ttl  = pos_ttl
+        self.neg_ttl  = neg_ttl
+        self.size     = size
+        self.entries  = OrderedDict() # (channel, uid) -> (is_member, expires_at)
+        self.inflight = {}            # (channel, uid) -> Task
+        self.stats    = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    async def check(self, bot, channel, uid):
+        key   = (channel, uid)
+        entry = self.entries.get(key)
+        if entry and entry[1] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+        task = self.inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+            task = asyncio.get_running_loop().create_task(self._fetch(bot, channel, uid))
+            self.inflight[key] = task
+        # shield: لغو شدن یکی از منتظرها درخواست مشترک را لغو نکند
+        return await asyncio.shield(task)
+
+    async def _fetch(self, bot, channel, uid):
+        key = (channel, uid)
+        try:
+            result = await fetch_membership(bot, channel, uid)
+        finally:
+            self.inflight.pop(key, None)
+        self.entries[key] = (result, time.monotonic() + (self.pos_ttl if result else self.neg_ttl))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+        return result
+
+    def invalidate(self, uid=None):
+        # بدون uid کل کش پاک می‌شود؛ در غیر این صورت فقط ورودی‌های آن کاربر
+        if uid is None:
+            count = len(self.entries)
+            self.entries.clear()
+            return count
+        keys = [k for k in self.entries if k[1] == uid]
+        for k in keys:
+            del self.entries[k]
+        return len(keys)
+
+member_cache = MembershipCache(MEMBER_TTL_POS, MEMBER_TTL_NEG, MEMBER_CACHE_SIZE)
 
 # --- بررسی عضویت کاربر در کانال ---
 async def is_member(bot, channel, uid):
     if not channel or channel == "@YourChannel": # برای تست می توانید این شرط را حذف کنید
         return True
+    return await member_cache.check(bot, channel, uid)
+
+async def fetch_membership(bot, channel, uid):
+    started = time.perf_counter()
     try:
         m = await bot.get_chat_member(channel, uid)
         return m.status in {"creator","administrator","member","restricted"}
     except BadRequest as e:
+        metrics.inc("wheel_telegram_api_errors_total", method="getChatMember")
         print(f"Error checking channel membership for {uid} in {channel}: {e}")
         return False
+    finally:
+        metrics.observe("wheel_telegram_api_seconds", time.perf_counter() - started, method="getChatMember")
+
+# --- ذخیره وضعیت مکالمه‌ها و context.user_data در store ---
+# تا کاربری که وسط ثبت‌نام (یا ادمینی که وسط ویرایش جایزه) است با ری‌استارت ربات از اول شروع نکند.
+# PTB فقط کلیدهای تغییرکرده را (هر STATE_FLUSH_INTERVAL ثانیه) به این کلاس می‌دهد؛ user_data کاربرانی که
+# محتوایشان واقعاً عوض نشده دوباره نوشته نمی‌شود. هر کلید فقط یک سطر/خط در store است، نه pickle کل داده‌ها.
+# در شروع فقط مکالمه‌ها خوانده می‌شوند؛ user_data هر کاربر با اولین آپدیتش (refresh_user_data) از store می‌آید.
+class StorePersistence(BasePersistence):
+    def __init__(self, update_interval):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+                         update_interval=update_interval)
+        self.saved = {} # uid -> آخرین user_data خوانده/نوشته‌شده (به صورت JSON)
+
+    async def get_user_data(self):
+        return {}
+
+    async def update_user_data(self, user_id, data):
+        encoded = json.dumps(data, sort_keys=True)
+        if self.saved.get(user_id, "{}") != encoded:
+            self.saved[user_id] = encoded
+            store.save_user_data(user_id, data)
+
+    async def drop_user_data(self, user_id):
+        self.saved.pop(user_id, None)
+        store.save_user_data(user_id, None)
+
+    async def get_conversations(self, name):
+        return store.load_conversations(name)
+
+    async def update_conversation(self, name, key, new_state):
+        store.save_conversation(name, key, new_state)
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id not in self.saved:
+            data = store.load_user_data(user_id)
+            self.saved[user_id] = json.dumps(data, sort_keys=True)
+            user_data.update(data)
+
+    # chat_data، bot_data و callback_data استفاده نمی‌شوند
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        pass # نوشتن نهایی با writer.close در on_shutdown انجام می‌شود
 
 # --- شروع مکالمه با ربات ---
 async def start(update:Update, context:ContextTypes.DEFAULT_TYPE):
@@ -91,7 +2069,9 @@ async def start(update:Update, context:ContextTypes.DEFAULT_TYPE):
 # --- چرخاندن گردونه شانس ---
 async def spin(update:Update, context:ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
-    user_data_in_db = users.get(uid, {})
+    user_data_in_db = store.get_user(uid)
+    if user_data_in_db.get("blocked"): # کاربری که قبلاً ربات را مسدود کرده بود برگشته است
+        store.update_user(uid, blocked=0)
 
     # 1. بررسی عضویت در کانال
     if config["channel_username"] and not await is_member(context.bot, config["channel_username"], update.effective_user.id):
@@ -110,7 +2090,7 @@ async def spin(update:Update, context:ContextTypes.DEFAULT_TYPE):
             reply_markup=kb
         )
         context.user_data["stage"] = PHONE # تنظیم مرحله برای ConversationHandler
-        return ConversationHandler.WAITING_FOR_PHONE
+        return PHONE
 
     # 3. درخواست نام و نام‌خانوادگی (اگر قبلاً ثبت نشده)
     if "name" not in user_data_in_db:
@@ -119,39 +2099,53 @@ async def spin(update:Update, context:ContextTypes.DEFAULT_TYPE):
             reply_markup=ReplyKeyboardRemove()
         )
         context.user_data["stage"] = NAME # تنظیم مرحله برای ConversationHandler
-        return ConversationHandler.WAITING_FOR_NAME
+        return NAME
+
+    # از اینجا تا ثبت نتیجه هیچ await ای نیست: دور، جوایز و نمونه‌گیر همه از همین یک snapshot خوانده می‌شوند
+    cfg = config
+
+    # 4. بازه باز بودن دور (فقط با زمان‌بندی)
+    if not round_is_open(cfg, time.time()):
+        due = next_round_at(cfg)
+        await update.message.reply_text(
+            f"⏰ *دور شماره {cfg.current_round}* به پایان رسیده است."
+            + (f"\nدور بعد: {format_time(due)}" if due else ""),
+            parse_mode='Markdown'
+        )
+        return
 
-    # 4. بررسی اینکه کاربر در دور فعلی چرخیده است یا خیر
-    if user_data_in_db.get("round", 0) >= config["current_round"]:
+    # 5. بررسی اینکه کاربر در دور فعلی چرخیده است یا خیر؛ claim_spin دور را به صورت اتمی ثبت می‌کند
+    # (حتی اگر دو پروسه همزمان /spin همین کاربر را پردازش کنند، فقط یکی موفق می‌شود)
+    previous_round = user_data_in_db.get("round", 0)
+    if previous_round >= cfg.current_round or not store.claim_spin(uid, cfg.current_round):
         await update.message.reply_text(
-            f"🚫 شما قبلاً در *دور شماره {config['current_round']}* گردونه را چرخاندید. "
+            f"🚫 شما قبلاً در *دور شماره {cfg.current_round}* گردونه را چرخاندید. "
             "لطفاً برای دور بعدی منتظر بمانید! 😉",
             parse_mode='Markdown'
         )
         return
 
-    # 5. انجام قرعه‌کشی
-    if not config["prizes"]:
+    # 6. انجام قرعه‌کشی
+    drawn = draw_prize() if cfg.prizes else None # جوایز بدون وزن، وزن صفر یا تمام‌شده در نمونه‌گیر نیستند
+    if drawn is None:
+        store.update_user(uid, round=previous_round) # چرخشی انجام نشد؛ سهم این دور پس داده می‌شود
+    if not cfg.prizes:
         await update.message.reply_text("🚨 هیچ جایزه‌ای برای قرعه‌کشی تعریف نشده است! لطفاً ادمین را مطلع کنید.")
         return
-
-    # فیلتر کردن جوایز بدون وزن یا وزن صفر
-    valid_prizes = [p for p in config["prizes"] if p.get("weight", 0) > 0]
-    if not valid_prizes:
-        await update.message.reply_text("🚨 هیچ جایزه‌ای با وزن معتبر برای قرعه‌کشی وجود ندارد! لطفاً ادمین را مطلع کنید.")
+    if drawn is None:
+        await update.message.reply_text("🚨 هیچ جایزه‌ای با وزن معتبر یا موجودی باقی‌مانده برای قرعه‌کشی وجود ندارد! لطفاً ادمین را مطلع کنید.")
         return
+    prize, u, used = drawn
+    chosen_prize = prize["name"]
 
-    chosen_prize = random.choices(
-        valid_prizes,
-        weights=[p["weight"] for p in valid_prizes]
-    )[0]["name"]
-
-    # 6. ذخیره اطلاعات کاربر و نتیجه
-    user_data_in_db["round"] = config["current_round"]
-    user_data_in_db["spin_count"] = user_data_in_db.get("spin_count", 0) + 1 # تعداد چرخش های کاربر
-    user_data_in_db["last_prize"] = chosen_prize # ذخیره آخرین جایزه برنده شده
-    users[uid] = user_data_in_db
-    save_json(USERS_FILE, users)
+    # 7. ذخیره اطلاعات کاربر و نتیجه
+    first = not user_data_in_db.get("spin_count") # قبل از update_user (در حالت JSON همان dict تغییر می‌کند)
+    store.update_user(uid,
+        spin_count=user_data_in_db.get("spin_count", 0) + 1, # تعداد چرخش های کاربر
+        last_prize=chosen_prize, # ذخیره آخرین جایزه برنده شده
+        last_spin_at=time.time()
+    )
+    spin_stats.record(uid, cfg.current_round, prize, u, used, first) # تاریخچه و آمار چرخش‌ها (همراه نسخه پیکربندی)
 
     await update.message.reply_text(
         f"🎉 گردونه شانس چرخید! شما برنده شدید: \n\n✨ **{chosen_prize}** ✨\n\n"
@@ -168,13 +2162,13 @@ async def receive_phone(update:Update, context:ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("🚫 لطفاً فقط شماره موبایل خودتان را از طریق دکمه 'ارسال شماره' بفرستید.")
         return PHONE # بازگشت به مرحله PHONE
 
-    uid = str(update.effective_user.id)
-    users.setdefault(uid, {})["phone"] = contact_info.phone_number
-    save_json(USERS_FILE, users)
+    uid   = str(update.effective_user.id)
+    phone = normalize_phone(contact_info.phone_number)
+    store.update_user(uid, phone=phone)
 
     # افزودن ادمین بر اساس شماره موبایل
-    if contact_info.phone_number.endswith(ADMIN_PHONE.lstrip('+')):
-        ADMIN_IDS.add(update.effective_user.id)
+    if is_admin_phone(phone) and update.effective_user.id not in roles.roles:
+        roles.set(update.effective_user.id, "admin")
 
     await update.message.reply_text(
         "✅ شماره موبایل شما با موفقیت ثبت شد!\n"
@@ -194,8 +2188,7 @@ async def receive_name(update:Update, context:ContextTypes.DEFAULT_TYPE):
         return NAME # بازگشت به مرحله NAME
 
     uid = str(update.effective_user.id)
-    users.setdefault(uid, {})["name"] = name
-    save_json(USERS_FILE, users)
+    store.update_user(uid, name=name)
 
     await update.message.reply_text(
         "🎉 ثبت‌نام شما با موفقیت کامل شد!\n"
@@ -213,29 +2206,44 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
 
 # --- پنل ادمین ---
-@admin_only
+@viewer_only
 async def admin_panel(update:Update, context:ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("🔄 شروع دور جدید", callback_data="admin_next_round")],
+        [InlineKeyboardButton("📣 اطلاع‌رسانی دور به کاربران", callback_data="admin_broadcast_start"),
+         InlineKeyboardButton("📈 وضعیت", callback_data="admin_broadcast_status")],
         [InlineKeyboardButton("➕ افزودن جایزه", callback_data="admin_add_prize")],
         [InlineKeyboardButton("📝 مدیریت جوایز", callback_data="admin_manage_prizes")],
-        [InlineKeyboardButton("📊 گزارش کاربران", callback_data="admin_user_report")] # اضافه شده
+        [InlineKeyboardButton("📊 گزارش کاربران", callback_data="admin_user_report"), # اضافه شده
+         InlineKeyboardButton("📈 آمار دور", callback_data="admin_stats")],
+        [InlineKeyboardButton("🧹 پاک کردن کش عضویت", callback_data="admin_clear_member_cache")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
+    ws = writer.stats
+    ms = member_cache.stats
+    ss = send_scheduler.stats if send_scheduler else None
     await update.message.reply_text(
         f"🤖 به پنل ادمین خوش آمدید!\n"
-        f"دور فعلی: *{config['current_round']}*",
+        f"دور فعلی: *{config['current_round']}* (نسخه پیکربندی {config.version})\n"
+        f"{escape_markdown(schedule_text())}\n"
+        f"💾 ذخیره‌سازی: {ws['mutations']} تغییر در {ws['flushes']} نوبت نوشتن "
+        f"(آخرین: {ws['last_batch']}، بیشترین: {ws['max_batch']}، {ws['last_flush_ms']:.1f}ms)\n"
+        f"👥 کش عضویت: {len(member_cache.entries)} ورودی، {ms['hits']} hit، {ms['misses']} miss، "
+        f"{ms['coalesced']} مشترک، {ms['evictions']} حذف\n"
+        f"🚦 /spin رد شده: {inbound_stats['spin_rejected_user']} (کاربر)، {inbound_stats['spin_rejected_global']} (سراسری)"
+        + (f"\n📤 صف ارسال: {send_scheduler.depth} در صف (بیشترین {ss['max_depth']})، {ss['sent']} ارسال، "
+           f"انتظار میانگین {ss['wait_ms_total'] / max(ss['sent'], 1):.0f}ms و بیشترین {ss['wait_ms_max']:.0f}ms، "
+           f"{ss['retries']} RetryAfter" if ss else ""),
         reply_markup=reply_markup,
         parse_mode='Markdown'
     )
 
 # --- شروع دور جدید (فقط برای ادمین) ---
-@admin_only
+@operator_only
 async def admin_next_round(update:Update, context:ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    config["current_round"] += 1
-    save_json(CONFIG_FILE, config)
+    start_next_round()
     await query.edit_message_text(
         f"✅ *دور جدید* با موفقیت آغاز شد! \n\n"
         f"هم‌اکنون در *دور شماره {config['current_round']}* هستیم. \n"
@@ -247,7 +2255,7 @@ async def admin_next_round(update:Update, context:ContextTypes.DEFAULT_TYPE):
 
 
 # --- مدیریت جوایز ---
-@admin_only
+@operator_only
 async def admin_manage_prizes(update:Update, context:ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -260,7 +2268,9 @@ async def admin_manage_prizes(update:Update, context:ContextTypes.DEFAULT_TYPE):
     prize_list_text = "لیست جوایز فعلی:\n\n"
     keyboard = []
     for i, prize in enumerate(config["prizes"]):
-        prize_list_text += f"{i+1}. {prize['name']} (وزن: {prize['weight']})\n"
+        left = stock.remaining(prize)
+        prize_list_text += f"{i+1}. {prize['name']} (وزن: {prize['weight']}"
+        prize_list_text += f"، موجودی: {left}/{prize['stock']})\n" if left is not None else ")\n"
         keyboard.append([
             InlineKeyboardButton(f"✏️ ویرایش {i+1}", callback_data=f"edit_prize_{i}"),
             InlineKeyboardButton(f"🗑️ حذف {i+1}", callback_data=f"delete_prize_{i}")
@@ -274,54 +2284,69 @@ async def admin_manage_prizes(update:Update, context:ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup
     )
 
-@admin_only
+@operator_only
 async def admin_add_prize(update:Update, context:ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     await query.message.reply_text("لطفاً *نام جایزه جدید* را وارد کنید (مثال: '۱۰۰ هزار تومان اعتبار').", parse_mode='Markdown')
     return ADD_PRIZE_NAME # تغییر مرحله برای مکالمه
 
-@admin_only
+# --- خواندن «وزن [موجودی]» از پیام ادمین؛ موجودی '-' یعنی نامحدود، نبودنش یعنی بدون تغییر ---
+def parse_weight_and_stock(text, keep=None):
+    parts = text.split()
+    if not 1 <= len(parts) <= 2:
+        raise ValueError
+    weight = int(parts[0])
+    if len(parts) == 1:
+        prize_stock = keep
+    else:
+        prize_stock = None if parts[1] == "-" else int(parts[1])
+    if weight < 0 or (prize_stock is not None and prize_stock < 0):
+        raise ValueError
+    return weight, prize_stock
+
+@operator_only
 async def admin_receive_new_prize_name(update:Update, context:ContextTypes.DEFAULT_TYPE):
     context.user_data["new_prize_name"] = update.message.text.strip()
     await update.message.reply_text(
         f"نام جایزه '{context.user_data['new_prize_name']}' ثبت شد.\n"
-        "حالا لطفاً *وزن* این جایزه را وارد کنید (یک عدد صحیح برای احتمال برنده شدن، مثلاً '۱۰' برای احتمال بیشتر).",
+        "حالا لطفاً *وزن* این جایزه را وارد کنید (یک عدد صحیح برای احتمال برنده شدن، مثلاً '۱۰' برای احتمال بیشتر).\n"
+        "برای محدود کردن تعداد این جایزه در هر دور، موجودی را بعد از وزن بنویسید (مثال: '۱۰ ۵۰').",
         parse_mode='Markdown'
     )
     return ADD_PRIZE_WEIGHT # تغییر مرحله
 
-@admin_only
+@operator_only
 async def admin_receive_new_prize_weight(update:Update, context:ContextTypes.DEFAULT_TYPE):
     try:
-        weight = int(update.message.text.strip())
-        if weight < 0:
-            raise ValueError
+        weight, prize_stock = parse_weight_and_stock(update.message.text)
     except ValueError:
-        await update.message.reply_text("⚠️ وزن باید یک عدد صحیح و مثبت باشد. لطفاً دوباره وارد کنید.")
+        await update.message.reply_text("⚠️ وزن (و موجودی) باید عدد صحیح و مثبت باشد. لطفاً دوباره وارد کنید.")
         return ADD_PRIZE_WEIGHT
 
     new_prize = {
         "name": context.user_data.pop("new_prize_name"),
         "weight": weight
     }
-    config["prizes"].append(new_prize)
-    save_json(CONFIG_FILE, config)
+    if prize_stock is not None:
+        new_prize["stock"] = prize_stock
+    commit_config(prizes=[*config.prizes, new_prize])
     await update.message.reply_text(f"✅ جایزه '{new_prize['name']}' با وزن {new_prize['weight']} با موفقیت اضافه شد.")
     # بازگشت به پنل ادمین
     await admin_panel(update, context)
     return ConversationHandler.END
 
 
-@admin_only
+@operator_only
 async def admin_edit_prize_start(update:Update, context:ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     prize_index = int(query.data.split('_')[-1])
     
     if 0 <= prize_index < len(config["prizes"]):
-        context.user_data["edit_prize_index"] = prize_index
         current_prize = config["prizes"][prize_index]
+        context.user_data["edit_prize_index"] = prize_index
+        context.user_data["edit_prize_original"] = current_prize["name"] # تا ثبت، جایزه نباید جابه‌جا یا حذف شده باشد
         await query.message.reply_text(
             f"در حال ویرایش جایزه: *{current_prize['name']}* (وزن: {current_prize['weight']})\n\n"
             "لطفاً *نام جدید* برای این جایزه را وارد کنید. اگر نمی‌خواهید تغییر دهید، همان نام قبلی را دوباره بنویسید.",
@@ -333,34 +2358,46 @@ async def admin_edit_prize_start(update:Update, context:ContextTypes.DEFAULT_TYP
         await admin_panel(query, context)
         return ConversationHandler.END
 
-@admin_only
+@operator_only
 async def admin_receive_edited_prize_name(update:Update, context:ContextTypes.DEFAULT_TYPE):
-    prize_index = context.user_data["edit_prize_index"]
-    config["prizes"][prize_index]["name"] = update.message.text.strip()
-    context.user_data["edited_prize_name"] = update.message.text.strip() # برای نمایش در پیام بعدی
+    # نام فقط نگه داشته می‌شود؛ نام و وزن با هم در مرحله بعد (بعد از اعتبارسنجی وزن) ثبت می‌شوند
+    context.user_data["edited_prize_name"] = update.message.text.strip()
 
     await update.message.reply_text(
-        f"نام جایزه به '{update.message.text.strip()}' تغییر یافت.\n"
-        "حالا لطفاً *وزن جدید* را وارد کنید (یک عدد صحیح).",
+        f"نام جدید '{update.message.text.strip()}' دریافت شد.\n"
+        "حالا لطفاً *وزن جدید* را وارد کنید (یک عدد صحیح).\n"
+        "برای تغییر موجودی هر دور، آن را بعد از وزن بنویسید ('-' برای نامحدود).",
         parse_mode='Markdown'
     )
     return EDIT_PRIZE_WEIGHT
 
-@admin_only
+@operator_only
 async def admin_receive_edited_prize_weight(update:Update, context:ContextTypes.DEFAULT_TYPE):
-    prize_index = context.user_data.pop("edit_prize_index")
+    prize_index = context.user_data["edit_prize_index"]
+    prizes = list(config.prizes)
+    if not (prize_index < len(prizes) and prizes[prize_index]["name"] == context.user_data.get("edit_prize_original")):
+        # جوایز در این فاصله (ادمین دیگر یا ویرایش config.json) تغییر کرده‌اند
+        for key in ("edit_prize_index", "edit_prize_original", "edited_prize_name"):
+            context.user_data.pop(key, None)
+        await update.message.reply_text("⚠️ لیست جوایز در این فاصله تغییر کرده است؛ ویرایش ثبت نشد. لطفاً دوباره تلاش کنید.")
+        await admin_panel(update, context)
+        return ConversationHandler.END
     try:
-        weight = int(update.message.text.strip())
-        if weight < 0:
-            raise ValueError
+        weight, prize_stock = parse_weight_and_stock(update.message.text, prizes[prize_index].get("stock"))
     except ValueError:
-        await update.message.reply_text("⚠️ وزن باید یک عدد صحیح و مثبت باشد. لطفاً دوباره وارد کنید.")
+        await update.message.reply_text("⚠️ وزن (و موجودی) باید عدد صحیح و مثبت باشد. لطفاً دوباره وارد کنید.")
         return EDIT_PRIZE_WEIGHT
+    context.user_data.pop("edit_prize_index")
+    context.user_data.pop("edit_prize_original", None)
+
+    edited_name = context.user_data.pop("edited_prize_name", prizes[prize_index]["name"])
+    edited = {k: v for k, v in prizes[prize_index].items() if k != "stock"}
+    edited.update(name=edited_name, weight=weight)
+    if prize_stock is not None:
+        edited["stock"] = prize_stock
+    prizes[prize_index] = edited
+    commit_config(prizes=prizes) # نام، وزن و موجودی با هم در یک نسخه جدید
 
-    config["prizes"][prize_index]["weight"] = weight
-    save_json(CONFIG_FILE, config)
-    
-    edited_name = context.user_data.pop("edited_prize_name", config["prizes"][prize_index]["name"])
     await update.message.reply_text(
         f"✅ جایزه '{edited_name}' با وزن {weight} با موفقیت ویرایش شد."
     )
@@ -368,15 +2405,15 @@ async def admin_receive_edited_prize_weight(update:Update, context:ContextTypes.
     await admin_panel(update, context)
     return ConversationHandler.END
 
-@admin_only
+@operator_only
 async def admin_delete_prize(update:Update, context:ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     prize_index = int(query.data.split('_')[-1])
 
     if 0 <= prize_index < len(config["prizes"]):
-        deleted_prize = config["prizes"].pop(prize_index)
-        save_json(CONFIG_FILE, config)
+        deleted_prize = config.prizes[prize_index]
+        commit_config(prizes=[p for i, p in enumerate(config.prizes) if i != prize_index])
         await query.edit_message_text(f"🗑️ جایزه '{deleted_prize['name']}' با موفقیت حذف شد.")
     else:
         await query.edit_message_text("🚨 جایزه انتخاب شده معتبر نیست.")
@@ -384,45 +2421,361 @@ async def admin_delete_prize(update:Update, context:ContextTypes.DEFAULT_TYPE):
     # بازگشت به مدیریت جوایز
     await admin_manage_prizes(query, context)
 
-# --- گزارش کاربران (برای ادمین) ---
-@admin_only
-async def admin_user_report(update:Update, context:ContextTypes.DEFAULT_TYPE):
+# --- پاک کردن کش عضویت (برای ادمین) ---
+@operator_only
+async def admin_clear_member_cache(update:Update, context:ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
+    count = member_cache.invalidate()
+    await query.edit_message_text(f"🧹 {count} ورودی از کش عضویت پاک شد.")
+    await admin_panel(query, context)
+
+# --- حذف یک کاربر از کش عضویت: /uncache <uid> ---
+@operator_only
+async def admin_uncache_user(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        await update.message.reply_text("استفاده: /uncache <شناسه عددی کاربر>")
+        return
+    count = member_cache.invalidate(int(context.args[0]))
+    await update.message.reply_text(f"🧹 {count} ورودی کش عضویت برای کاربر {context.args[0]} پاک شد.")
+
+# --- گزارش کاربران (برای ادمین) ---
+# گزارش به صورت جریانی از store خوانده می‌شود (هیچ‌وقت کل کاربران در حافظه ساخته نمی‌شود):
+# نمایش صفحه‌به‌صفحه با دکمه‌های قبلی/بعدی، و خروجی کامل CSV/XLSX که در یک ترد ساخته می‌شود.
+# فیلترها با /report تنظیم می‌شوند، مثال: /report round=3 prize=🏆 جایزه ویژه since=2024-05-01
+REPORT_PAGE_SIZE = 10
+REPORT_COLUMNS   = ["uid", "name", "phone", "round", "spin_count", "last_prize", "last_spin_at"]
+
+def iter_report(filters=None, after=None):
+    filters = filters or {}
+    since   = filters.get("since")
+    for uid, data in store.iter_users(round=filters.get("round"), after=after):
+        if "prize" in filters and data.get("last_prize") != filters["prize"]:
+            continue
+        if since is not None and data.get("last_spin_at", 0) < since:
+            continue
+        yield uid, data
+
+def parse_report_filters(args):
+    # args مثل ["round=3", "prize=🏆", "جایزه", "since=2024-05-01"]؛ کلمات بدون '=' به مقدار قبلی می‌چسبند
+    filters, key = {}, None
+    for arg in args:
+        if "=" in arg and arg.split("=", 1)[0] in ("round", "prize", "since"):
+            key, value = arg.split("=", 1)
+            filters[key] = value
+        elif key:
+            filters[key] += " " + arg
+        else:
+            raise ValueError
+    if "round" in filters:
+        filters["round"] = int(filters["round"])
+    if "since" in filters:
+        filters["since"] = datetime.strptime(filters["since"], "%Y-%m-%d").timestamp()
+    return filters
 
-    if not users:
-        await query.edit_message_text("🤷‍♂️ هیچ کاربری در سیستم ثبت‌نام نکرده است.")
+def describe_filters(filters):
+    parts = []
+    if "round" in filters:
+        parts.append(f"دور {filters['round']}")
+    if "prize" in filters:
+        parts.append(f"جایزه {filters['prize']}")
+    if "since" in filters:
+        parts.append(f"از {datetime.fromtimestamp(filters['since']):%Y-%m-%d}")
+    return "، ".join(parts) or "همه کاربران"
+
+def format_time(ts):
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M") if ts else ""
+
+# صفحه‌ها با کلید (keyset) ورق می‌خورند: دکمه «بعدی» uid آخرین کاربر صفحه را در callback_data دارد و صفحه بعد با
+# iter_users(after=...) از همان‌جا ادامه می‌دهد، پس صفحه‌های عمیق هم فقط همان چند سطر را می‌خوانند. شروع هر صفحه
+# دیده‌شده در report_cursors نگه داشته می‌شود تا «قبلی» هم بدون پیمایش از اول کار کند.
+async def show_report_page(query, context, page, after=None):
+    filters = context.user_data.get("report_filters", {})
+    known = context.user_data.get("report_cursors", [])[:page]
+    cursors = known + [after] if len(known) == page else None # None: شروع صفحه‌های قبلی معلوم نیست
+    context.user_data["report_cursors"] = cursors or []
+    rows = list(islice(iter_report(filters, after=after), REPORT_PAGE_SIZE + 1))
+    has_next, rows = len(rows) > REPORT_PAGE_SIZE, rows[:REPORT_PAGE_SIZE]
+
+    if not rows and page == 0:
+        await query.edit_message_text(f"🤷‍♂️ هیچ کاربری با این فیلتر پیدا نشد ({describe_filters(filters)}).")
         await admin_panel(query, context)
         return
 
-    report_text = f"📊 *گزارش کاربران ثبت‌نام شده (دور {config['current_round']}):*\n\n"
-    for uid, user_data in users.items():
+    report_text = (f"📊 *گزارش کاربران ثبت‌نام شده (دور {config['current_round']}):*\n"
+                   f"🔎 {escape_markdown(describe_filters(filters))} — صفحه {page + 1}\n\n")
+    for uid, user_data in rows:
         name = user_data.get("name", "نام نامشخص")
         phone = user_data.get("phone", "شماره نامشخص")
         last_round_played = user_data.get("round", 0)
         last_prize = user_data.get("last_prize", "ندارد")
-        
+
         report_text += (
-            f"👤 *نام:* {name}\n"
-            f"📞 *شماره:* {phone}\n"
+            f"👤 *نام:* {escape_markdown(name)}\n"
+            f"📞 *شماره:* {escape_markdown(phone)}\n"
             f"⚙️ *آخرین دور بازی:* {last_round_played}\n"
-            f"🏆 *آخرین جایزه:* {last_prize}\n"
+            f"🏆 *آخرین جایزه:* {escape_markdown(last_prize)}\n"
             f"--- \n"
         )
-    
-    # تلگرام محدودیت طول پیام دارد. اگر گزارش خیلی طولانی شود، باید آن را بخش‌بندی کنیم.
-    # برای سادگی، فعلاً فرض می‌کنیم طول پیام کافی است.
-    if len(report_text) > 4000: # تقریباً حداکثر طول پیام در تلگرام
-        await query.edit_message_text("⚠️ گزارش خیلی طولانی است و نمی‌تواند کامل نمایش داده شود. در حال کار بر روی قابلیت خروجی فایل...")
-        # در آینده اینجا می توانید فایل CSV/Excel را ایجاد و ارسال کنید
+
+    nav = []
+    if page > 0:
+        previous = f"report_page_{page - 1}_{cursors[page - 1] or ''}" if cursors else "report_page_0_"
+        nav.append(InlineKeyboardButton("◀️ قبلی", callback_data=previous))
+    if has_next:
+        nav.append(InlineKeyboardButton("بعدی ▶️", callback_data=f"report_page_{page + 1}_{rows[-1][0]}"))
+    export = [InlineKeyboardButton("📄 خروجی CSV", callback_data="report_export_csv")]
+    if openpyxl is not None:
+        export.append(InlineKeyboardButton("📗 خروجی Excel", callback_data="report_export_xlsx"))
+    keyboard = [row for row in (nav, export) if row]
+    keyboard.append([InlineKeyboardButton("🔙 بازگشت به پنل ادمین", callback_data="admin_panel_back")])
+    await query.edit_message_text(report_text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+
+@viewer_only
+async def admin_user_report(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    await show_report_page(query, context, 0)
+
+@viewer_only
+async def admin_report_page(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    _, _, page, after = (query.data + "_").split('_')[:4]
+    if not after and int(page) > 0: # دکمه پیام‌های قدیمی بدون cursor
+        page = 0
+    await show_report_page(query, context, int(page), after or None)
+
+# --- تنظیم فیلتر گزارش: /report [round=N] [prize=...] [since=YYYY-MM-DD] ---
+@viewer_only
+async def admin_report_command(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    try:
+        context.user_data["report_filters"] = parse_report_filters(context.args)
+    except ValueError:
+        await update.message.reply_text("استفاده: /report [round=شماره دور] [prize=نام جایزه] [since=YYYY-MM-DD]")
+        return
+    keyboard = [[InlineKeyboardButton("📊 مشاهده گزارش", callback_data="admin_user_report")]]
+    await update.message.reply_text(f"🔎 فیلتر گزارش: {describe_filters(context.user_data['report_filters'])}",
+                                    reply_markup=InlineKeyboardMarkup(keyboard))
+
+# --- خروجی فایل گزارش ---
+# فایل در ترد جداگانه سطر به سطر نوشته می‌شود؛ حافظه مصرفی به تعداد کاربران بستگی ندارد.
+def report_rows(filters):
+    for uid, data in iter_report(filters):
+        yield [uid, data.get("name", ""), data.get("phone", ""), data.get("round", 0),
+               data.get("spin_count", 0), data.get("last_prize", ""), format_time(data.get("last_spin_at"))]
+
+def write_report_csv(path, filters):
+    count = 0
+    with open(path, "w", encoding="utf-8-sig", newline="") as f: # utf-8-sig تا Excel فارسی را درست نشان دهد
+        out = csv.writer(f)
+        out.writerow(REPORT_COLUMNS)
+        for row in report_rows(filters):
+            out.writerow(row)
+            count += 1
+    return count
+
+def write_report_xlsx(path, filters):
+    count = 0
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("users")
+    ws.append(REPORT_COLUMNS)
+    for row in report_rows(filters):
+        ws.append(row)
+        count += 1
+    wb.save(path)
+    return count
+
+@viewer_only
+async def admin_report_export(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer("⏳ در حال ساخت فایل گزارش...")
+    kind    = query.data.split('_')[-1]
+    filters = dict(context.user_data.get("report_filters", {}))
+    fd, path = tempfile.mkstemp(suffix="." + kind)
+    os.close(fd)
+    try:
+        write = write_report_xlsx if kind == "xlsx" else write_report_csv
+        count = await asyncio.get_running_loop().run_in_executor(None, write, path, filters)
+        with open(path, "rb") as f:
+            await query.message.reply_document(
+                document=f,
+                filename=f"users_round{config['current_round']}_{datetime.now():%Y%m%d_%H%M}.{kind}",
+                caption=f"📊 {count} کاربر ({describe_filters(filters)})"
+            )
+    finally:
+        os.remove(path)
+
+
+# --- آمار چرخش‌ها (از شمارنده‌های تجمعی؛ بدون پیمایش کاربران یا تاریخچه) ---
+def chi_square_p(chi2, df):
+    # احتمال دم بالای توزیع χ² با تقریب Wilson–Hilferty (برای df کوچک هم به اندازه کافی دقیق است)
+    if df <= 0:
+        return 1.0
+    z = ((chi2 / df) ** (1 / 3) - (1 - 2 / (9 * df))) / math.sqrt(2 / (9 * df))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def stats_text(round):
+    rnd = spin_stats.round(round)
+    if not rnd:
+        return f"📈 آمار دور {round}\n\nهنوز هیچ چرخشی در این دور ثبت نشده است."
+    spins, expected = rnd["spins"], spin_stats.expected(round)
+    lines = [f"📈 آمار دور {round}",
+             f"🎡 چرخش‌ها (شرکت‌کنندگان این دور): {spins}",
+             f"👥 کل شرکت‌کنندگان تا امروز: {spin_stats.data['participants']}", ""]
+    chi2 = 0.0
+    for prize in sorted(set(expected) | set(rnd["wins"]), key=lambda p: -expected.get(p, 0)):
+        observed, exp = rnd["wins"].get(prize, 0), expected.get(prize, 0)
+        lines.append(f"🏆 {prize}: {observed} ({observed / spins:.1%}) — انتظار {exp:.1f} ({exp / spins:.1%})")
+        if exp > 0:
+            chi2 += (observed - exp) ** 2 / exp
+    df = len(expected) - 1
+    p  = chi_square_p(chi2, df)
+    lines += ["", f"χ² = {chi2:.2f} (df={df})، p ≈ {p:.3f}",
+              "✅ نتایج با وزن جوایز سازگار است." if p >= 0.01 else "⚠️ انحراف معنادار از وزن جوایز (p < 0.01)!"]
+    if expected and min(expected.values()) < 5:
+        lines.append("ℹ️ هنوز چرخش کافی برای آزمون دقیق نیست (تعداد مورد انتظار بعضی جوایز کمتر از ۵).")
+    return "\n".join(lines)
+
+async def show_stats(query, round):
+    if WORKERS > 1:
+        spin_stats.refresh()
+    nav = []
+    if round > 1:
+        nav.append(InlineKeyboardButton("◀️ دور قبل", callback_data=f"stats_round_{round - 1}"))
+    if round < config["current_round"]:
+        nav.append(InlineKeyboardButton("دور بعد ▶️", callback_data=f"stats_round_{round + 1}"))
+    keyboard = [row for row in (nav,) if row]
+    keyboard.append([InlineKeyboardButton("🔙 بازگشت به پنل ادمین", callback_data="admin_panel_back")])
+    await query.edit_message_text(stats_text(round), reply_markup=InlineKeyboardMarkup(keyboard))
+
+@viewer_only
+async def admin_stats(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    await show_stats(query, config["current_round"])
+
+@viewer_only
+async def admin_stats_round(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    await show_stats(query, int(query.data.split('_')[-1]))
+
+# --- اطلاع‌رسانی شروع دور به همه کاربران ---
+def broadcast_progress_text():
+    s = broadcaster.state
+    if not s:
+        return "📣 هنوز هیچ اطلاع‌رسانی‌ای انجام نشده است."
+    status  = {"running": "⏳ در حال ارسال", "done": "✅ تمام شد", "cancelled": "⏹ متوقف شد"}[s["status"]]
+    elapsed = s.get("finished_at", time.time()) - s["started_at"]
+    return (f"📣 اطلاع‌رسانی دور {s['round']}: {status}\n"
+            f"✉️ ارسال‌شده: {s['sent']}\n"
+            f"❌ ناموفق: {s['failed']}\n"
+            f"🚫 مسدودکرده: {s['blocked']} (و {s['skipped']} از قبل)\n"
+            f"⏳ باقی‌مانده: {max(s['total'] - s['done'], 0)} از {s['total']}\n"
+            f"⏱ {elapsed:.0f} ثانیه، {s['sent'] / max(elapsed, 1):.0f} پیام در ثانیه")
+
+async def show_broadcast_progress(query):
+    keyboard = [[InlineKeyboardButton("🔄 بروزرسانی", callback_data="admin_broadcast_status")]]
+    if broadcaster.running:
+        keyboard.append([InlineKeyboardButton("⏹ توقف ارسال", callback_data="admin_broadcast_cancel")])
+    keyboard.append([InlineKeyboardButton("🔙 بازگشت به پنل ادمین", callback_data="admin_panel_back")])
+    try:
+        await query.edit_message_text(broadcast_progress_text(), reply_markup=InlineKeyboardMarkup(keyboard))
+    except BadRequest as e: # «بروزرسانی» وقتی چیزی تغییر نکرده
+        if "not modified" not in str(e):
+            raise
+
+@operator_only
+async def admin_broadcast_start(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    s = broadcaster.state
+    if broadcaster.running:
+        await query.answer("یک اطلاع‌رسانی در حال اجراست.")
+    elif s.get("round") == config["current_round"] and s.get("status") == "done":
+        await query.answer("شروع این دور قبلاً به همه اطلاع داده شده است.")
     else:
-        await query.edit_message_text(report_text, parse_mode='Markdown')
-    
-    # بازگشت به پنل ادمین
-    keyboard = [[InlineKeyboardButton("🔙 بازگشت به پنل ادمین", callback_data="admin_panel_back")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.message.reply_text("برای انجام کارهای دیگر ادمین:", reply_markup=reply_markup)
+        await query.answer("📣 اطلاع‌رسانی شروع شد.")
+        broadcaster.start(context.bot, f"🎡 دور {config['current_round']} گردونه شانس شروع شد!\n"
+                                       "همین حالا با /spin شانس خودتو امتحان کن. 🍀", config["current_round"])
+    await show_broadcast_progress(query)
+
+@viewer_only
+async def admin_broadcast_status(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    await show_broadcast_progress(query)
+
+@operator_only
+async def admin_broadcast_cancel(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    await broadcaster.cancel()
+    await show_broadcast_progress(query)
 
+# --- مدیریت نقش‌ها: /role <uid> <admin|operator|viewer|none> ---
+@admin_only
+async def admin_set_role(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        lines = [f"{ROLE_TITLES[role]}: {uid}" for uid, role in sorted(roles.roles.items(), key=lambda x: -ROLE_RANK[x[1]])]
+        await update.message.reply_text("نقش‌های فعلی:\n" + ("\n".join(lines) or "هیچ نقشی تعریف نشده است."))
+        return
+    if len(context.args) != 2 or not context.args[0].isdigit() or context.args[1] not in (*ROLE_RANK, "none"):
+        await update.message.reply_text("استفاده: /role <شناسه عددی کاربر> <admin|operator|viewer|none>")
+        return
+    uid, role = int(context.args[0]), context.args[1]
+    if uid == update.effective_user.id and role != "admin":
+        await update.message.reply_text("🚫 نمی‌توانید نقش ادمین خودتان را بردارید.")
+        return
+    roles.set(uid, None if role == "none" else role)
+    await update.message.reply_text(f"✅ نقش کاربر {uid}: {ROLE_TITLES.get(role, 'بدون نقش')}")
+
+# --- زمان‌بندی خودکار دورها: /schedule ---
+SCHEDULE_USAGE = ("استفاده:\n/schedule — وضعیت فعلی\n/schedule every 1d [window 20h]\n"
+                  "/schedule cron 0 0 * * * [window 20h]\n/schedule off")
+
+def schedule_text():
+    s = config.schedule
+    if not s:
+        return "⏰ زمان‌بندی خودکار: خاموش (دور فقط دستی عوض می‌شود)"
+    rule = f"cron {s['cron']}" if "cron" in s else f"هر {format_duration(s['every'])}"
+    lines = [f"⏰ زمان‌بندی خودکار: {rule}" + (f"، باز به مدت {format_duration(s['window'])}" if s.get("window") else "")]
+    if config.round_window and config.round_window.get("closes"):
+        lines.append(f"🔒 پایان دور فعلی: {format_time(config.round_window['closes'])}")
+    due = next_round_at(config)
+    lines.append(f"⏭ دور بعد: {format_time(due)}" if due else "⏭ دور بعدی در برنامه نیست")
+    return "\n".join(lines)
+
+@operator_only
+async def admin_schedule(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    args = context.args
+    if not args:
+        await update.message.reply_text(schedule_text())
+        return
+    if args == ["off"]:
+        commit_config(schedule=None, round_window=None)
+        await update.message.reply_text(schedule_text())
+        return
+    try:
+        window = None
+        if len(args) >= 2 and args[-2] == "window":
+            window, args = parse_duration(args[-1]), args[:-2]
+        if args[0] == "every" and len(args) == 2:
+            schedule = {"every": parse_duration(args[1]), "start": int(time.time())}
+        elif args[0] == "cron":
+            schedule = {"cron": " ".join(args[1:])}
+        else:
+            raise ValueError
+        if window:
+            schedule["window"] = window
+        check_schedule(schedule)
+    except (ValueError, IndexError):
+        await update.message.reply_text(SCHEDULE_USAGE)
+        return
+    # دور فعلی باز می‌ماند و قانون از دور بعد اعمال می‌شود: شروع دور فعلی «همین حالا» حساب می‌شود تا اولین دور بعد
+    # از حالا شمرده شود (با شروع قدیمی‌تر، موعدی که در گذشته افتاده فوراً دور را عوض می‌کرد)
+    commit_config(schedule=schedule, round_window={"opens": time.time(), "closes": None})
+    await update.message.reply_text("✅ زمان‌بندی ذخیره شد.\n" + schedule_text())
 
 # --- بازگشت به پنل ادمین از طریق CallbackQuery ---
 async def admin_panel_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -430,15 +2783,338 @@ async def admin_panel_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     await admin_panel(query, context) # فراخوانی تابع پنل ادمین
 
-# --- Main function ---
-def main():
-    if not TOKEN:
-        raise RuntimeError("BOT_TOKEN not set! Please set the BOT_TOKEN environment variable.")
-    
-    app = ApplicationBuilder().token(TOKEN).build()
+# --- سرور /metrics، تأخیر حلقه رویداد و پروفایل نمونه‌ای ---
+# METRICS_PORT=0 (پیش‌فرض) یعنی خاموش. در حالت WORKERS هر worker روی METRICS_PORT+1+شماره خودش گوش می‌دهد.
+# با PROFILE_EVERY>0، هر PROFILE_EVERY ثانیه یک بار کل حلقه رویداد PROFILE_WINDOW ثانیه با cProfile ضبط
+# و روی نتیجه‌های قبلی جمع می‌شود (PROFILE_FILE، قابل خواندن با pstats یا snakeviz؛ خلاصه در /profile).
+class Observability:
+    def __init__(self):
+        self.server  = None
+        self.tasks   = []
+        self.profile = None # pstats.Stats تجمعی
+
+    async def start(self):
+        self.tasks.append(asyncio.ensure_future(self._watch_lag()))
+        if PROFILE_EVERY > 0:
+            self.tasks.append(asyncio.ensure_future(self._sample_profiles()))
+        if METRICS_PORT:
+            port = METRICS_PORT if WORKER_INDEX is None else METRICS_PORT + 1 + WORKER_INDEX
+            self.server = await asyncio.start_server(self._serve, METRICS_LISTEN, port)
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _watch_lag(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            metrics.observe("wheel_loop_lag_seconds", max(time.perf_counter() - started - LAG_INTERVAL, 0))
+
+    async def _sample_profiles(self):
+        import cProfile, pstats
+        while True:
+            await asyncio.sleep(PROFILE_EVERY)
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await asyncio.sleep(PROFILE_WINDOW)
+            finally:
+                profiler.disable()
+            if self.profile is None:
+                self.profile = pstats.Stats(profiler)
+            else:
+                self.profile.add(profiler)
+            self.profile.dump_stats(PROFILE_FILE)
+
+    def profile_text(self):
+        if self.profile is None:
+            return "profiling is off (set PROFILE_EVERY) or no window has finished yet\n"
+        out = io.StringIO()
+        self.profile.stream = out
+        self.profile.sort_stats("cumulative").print_stats(40)
+        return out.getvalue()
+
+    async def _serve(self, reader, writer):
+        try:
+            request = (await reader.readline()).split()
+            while (await reader.readline()).strip(): # هدرها لازم نیستند
+                pass
+            path = request[1].decode() if len(request) > 1 else ""
+            if path == "/metrics":
+                status, body = "200 OK", metrics.render()
+            elif path == "/profile":
+                status, body = "200 OK", self.profile_text()
+            else:
+                status, body = "404 Not Found", "not found\n"
+            body = body.encode()
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+observability = Observability()
+
+metrics.gauge("wheel_current_round", "gauge", "Current round", lambda: config.current_round)
+metrics.gauge("wheel_config_version", "gauge", "Version of the installed config snapshot", lambda: config.version)
+metrics.gauge("wheel_member_cache_entries", "gauge", "Entries in the membership cache", lambda: len(member_cache.entries))
+metrics.gauge("wheel_member_cache_total", "counter", "Membership cache lookups by outcome",
+              lambda: {(("outcome", k),): v for k, v in member_cache.stats.items()})
+metrics.gauge("wheel_spin_rejected_total", "counter", "/spin updates rejected by the rate limiter",
+              lambda: {(("scope", k.rsplit("_", 1)[-1]),): v for k, v in inbound_stats.items()})
+metrics.gauge("wheel_writes_pending", "gauge", "Mutations waiting for the next write-behind flush", lambda: writer.marks)
+if send_scheduler is not None:
+    metrics.gauge("wheel_send_queue_depth", "gauge", "Outbound messages waiting in the send queue",
+                  lambda: send_scheduler.depth)
+    metrics.gauge("wheel_send_retry_after_total", "counter", "RetryAfter responses from Telegram",
+                  lambda: send_scheduler.stats["retries"])
+
+# --- زمان‌سنجی هندلرها ---
+def timed(callback):
+    name = callback.__name__
+    @wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            metrics.inc("wheel_handler_errors_total", handler=name)
+            raise
+        finally:
+            metrics.observe("wheel_handler_seconds", time.perf_counter() - started, handler=name)
+    return wrapper
+
+def instrument_handlers(app):
+    for handler in iter_handlers(app):
+        if not isinstance(handler, TypeHandler): # دروازه‌ها (spin_gate، ...) با ApplicationHandlerStop کار می‌کنند
+            handler.callback = timed(handler.callback)
+
+# --- آماده‌سازی هنگام روشن شدن: ادمین‌هایی که قبلاً ثبت‌نام کرده‌اند (جستجوی ایندکس‌دار) ---
+async def on_startup(app):
+    for phone in ADMIN_PHONE_SET:
+        for uid in store.find_by_phone(phone):
+            if int(uid) not in roles.roles:
+                roles.set(int(uid), "admin")
+    if not WORKER_INDEX: # در حالت WORKERS فقط worker صفر اطلاع‌رسانی نیمه‌کاره و زمان‌بند دورها را دارد
+        broadcaster.resume(app.bot) # اطلاع‌رسانی نیمه‌کاره از آخرین نقطه ذخیره‌شده ادامه پیدا می‌کند
+        round_scheduler.start(app)  # دورهایی که در زمان خاموشی باید شروع می‌شدند همین‌جا جبران می‌شوند
+    config_watcher.start()
+    await observability.start()
+
+# --- توقف کارهای پس‌زمینه قبل از بسته شدن اتصال ربات ---
+async def on_stop(app):
+    await broadcaster.stop()
+    await config_watcher.stop()
+    await observability.stop()
+
+# --- ذخیره نهایی داده‌ها هنگام خاموش شدن ---
+async def on_shutdown(app):
+    await writer.close()
+    await store.close()
+
+# --- نوع آپدیت‌هایی که هندلرها واقعاً لازم دارند (به جای Update.ALL_TYPES) ---
+def iter_handlers(app):
+    # همه هندلرها، با باز کردن ConversationHandler ها
+    def visit(handler):
+        if isinstance(handler, ConversationHandler):
+            for h in (*handler.entry_points, *chain.from_iterable(handler.states.values()), *handler.fallbacks):
+                yield from visit(h)
+        else:
+            yield handler
+    for group in app.handlers.values():
+        for handler in group:
+            yield from visit(handler)
+
+def required_update_types(app):
+    types = set()
+    for handler in iter_handlers(app):
+        if isinstance(handler, CallbackQueryHandler):
+            types.add(Update.CALLBACK_QUERY)
+        elif isinstance(handler, (CommandHandler, MessageHandler)):
+            types.add(Update.MESSAGE)
+        elif isinstance(handler, TypeHandler): # دروازه‌ها (spin_gate، sync_shared_state) نوع آپدیت جدیدی لازم ندارند
+            pass
+        else: # هندلر ناشناخته: برای اینکه چیزی از دست نرود همه نوع آپدیت گرفته می‌شود
+            types.update(Update.ALL_TYPES)
+    return sorted(types)
+
+# --- حالت چند پروسه‌ای (WORKERS=N، فقط با STORAGE=sqlite و webhook) ---
+# پروسه اصلی (front-end) webhook تلگرام را می‌گیرد و هر آپدیت را بر اساس شناسه کاربر (uid % N) به یکی از
+# N پروسه worker می‌فرستد؛ پس همه آپدیت‌های یک کاربر (و مکالمه‌اش) همیشه به همان worker می‌رسند.
+# ارتباط با workerها یک اتصال TCP محلی است که هر خط آن یک آپدیت JSON است. workerها همه از یک فایل SQLite
+# استفاده می‌کنند (SqliteStore با shared=True) و قبل از هر آپدیت با config_version تغییرات پیکربندی، دور و
+# نقش‌هایی را که پروسه‌های دیگر داده‌اند بارگذاری می‌کنند. worker ای که از کار بیفتد دوباره اجرا می‌شود؛
+# آپدیت‌هایی که در آن لحظه در راه بوده‌اند ممکن است از دست بروند (تلگرام پاسخ 200 را گرفته است).
+seen_version = store.config_version()
+
+def reload_shared_state():
+    global seen_version
+    version = store.config_version()
+    if version == seen_version:
+        return
+    seen_version = version
+    install_config(ConfigSnapshot(store.load_config(DEFAULT_CONFIG)))
+    roles.load()
+
+async def sync_shared_state(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    reload_shared_state() # یک SELECT ایندکس‌دار؛ فقط وقتی نسخه عوض شده باشد چیزی بارگذاری می‌شود
+
+def update_user_id(data):
+    # شناسه فرستنده از آپدیت خام (message.from، callback_query.from، poll_answer.user، ...)
+    for value in data.values():
+        if isinstance(value, dict):
+            user = value.get("from") or value.get("user")
+            if user:
+                return user["id"]
+    return 0
+
+def update_worker(data, workers):
+    # هر کاربر همیشه به یک worker می‌رود؛ دکمه‌های اطلاع‌رسانی همگانی (شروع/وضعیت/توقف) فقط به worker صفر،
+    # همان که اطلاع‌رسانی نیمه‌کاره را بعد از ری‌استارت ادامه می‌دهد، تا هیچ‌وقت دو فرستنده همزمان نباشند
+    query = data.get("callback_query")
+    if query and str(query.get("data", "")).startswith("admin_broadcast_"):
+        return 0
+    return update_user_id(data) % workers
+
+class WorkerLink:
+    def __init__(self, index, port):
+        self.index   = index
+        self.port    = port
+        self.queue   = asyncio.Queue(WORKER_QUEUE)
+        self.retry   = None # خطی که نوشتنش با قطع اتصال ناتمام ماند
+        self.dropped = 0
+
+    def send(self, line):
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull: # worker مدت زیادی در دسترس نبوده
+            self.dropped += 1
+
+    async def run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+            except OSError: # worker هنوز بالا نیامده
+                await asyncio.sleep(0.2)
+                continue
+            try:
+                while True:
+                    line, self.retry = self.retry or await self.queue.get(), None
+                    self.retry = line
+                    writer.write(line)
+                    await writer.drain()
+                    self.retry = None
+            except ConnectionError:
+                print(f"Lost connection to worker {self.index}; reconnecting")
+            finally:
+                writer.close()
+
+async def run_worker_process(index, port, stopping):
+    env = dict(os.environ, WORKER_INDEX=str(index), WORKER_PORT=str(port))
+    while not stopping.is_set():
+        proc = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), "worker", env=env)
+        stop = asyncio.ensure_future(stopping.wait())
+        done, _ = await asyncio.wait({asyncio.ensure_future(proc.wait()), stop}, return_when=asyncio.FIRST_COMPLETED)
+        if stop in done:
+            proc.terminate()
+            await proc.wait()
+            return
+        stop.cancel()
+        print(f"Worker {index} exited with code {proc.returncode}; restarting")
+        await asyncio.sleep(1)
+
+async def run_frontend(allowed_updates):
+    if tornado is None:
+        raise RuntimeError("WORKERS needs tornado: pip install 'python-telegram-bot[webhooks]'")
+    links = [WorkerLink(i, WORKER_BASE_PORT + i) for i in range(WORKERS)]
+
+    class UpdateRouter(tornado.web.RequestHandler):
+        def post(self):
+            if self.request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+                raise tornado.web.HTTPError(403)
+            try:
+                data = json.loads(self.request.body)
+            except ValueError:
+                raise tornado.web.HTTPError(400)
+            line = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+            links[update_worker(data, len(links))].send(line)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+    tasks = [asyncio.ensure_future(link.run()) for link in links]
+    workers = [asyncio.ensure_future(run_worker_process(i, link.port, stopping)) for i, link in enumerate(links)]
+    server = tornado.web.Application([(rf"/{WEBHOOK_PATH}", UpdateRouter)]).listen(WEBHOOK_PORT, WEBHOOK_LISTEN)
+    bot = Bot(TOKEN, base_url=BOT_API_URL) if BOT_API_URL else Bot(TOKEN)
+    async with bot:
+        await bot.set_webhook(f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET,
+                              allowed_updates=allowed_updates)
+    print(f"Front-end routing to {WORKERS} workers... Press Ctrl+C to stop.")
+    await stopping.wait()
+    server.stop()
+    await asyncio.gather(*workers)
+    for task in tasks:
+        task.cancel()
+
+async def run_worker(port):
+    # همان Application ربات، بدون Updater: آپدیت‌ها از front-end مستقیم در update_queue گذاشته می‌شوند
+    builder = ApplicationBuilder().token(TOKEN).updater(None)
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+    app = build_app(builder)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    async def receive(reader, writer):
+        try:
+            while line := await reader.readline():
+                await app.update_queue.put(Update.de_json(json.loads(line), app.bot))
+        except (ConnectionError, asyncio.CancelledError): # front-end رفته یا worker در حال توقف است
+            pass
+        finally:
+            writer.close()
+
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    server = await asyncio.start_server(receive, "127.0.0.1", port)
+    await stopping.wait()
+    server.close()
+    await app.stop()
+    await app.post_stop(app)
+    await app.shutdown()
+    await app.post_shutdown(app)
+
+# --- ساخت Application و ثبت هندلرها ---
+# builder از بیرون داده می‌شود تا بنچمارک‌ها بتوانند ربات را به سرور جعلی تلگرام وصل کنند
+def build_app(builder):
+    if send_scheduler is not None:
+        builder = builder.rate_limiter(send_scheduler)
+    app = (
+        builder
+        .concurrent_updates(CONCURRENT_UPDATES or False)
+        .persistence(StorePersistence(STATE_FLUSH_INTERVAL))
+        .post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown)
+        .build()
+    )
+    if WORKERS > 1:
+        app.add_handler(TypeHandler(Update, sync_shared_state), group=-2) # تغییرات پروسه‌های دیگر
+    app.add_handler(TypeHandler(Update, spin_gate), group=-1) # محدودیت /spin قبل از همه هندلرها
 
     # --- ConversationHandler برای فرآیند ثبت‌نام کاربر ---
     conv_handler_register = ConversationHandler(
+        name="register", persistent=True,
         entry_points=[CommandHandler("spin", spin)],
         states={
             PHONE: [MessageHandler(filters.CONTACT, receive_phone)],
@@ -453,6 +3129,7 @@ def main():
 
     # --- ConversationHandler برای افزودن جایزه توسط ادمین ---
     conv_handler_add_prize = ConversationHandler(
+        name="add_prize", persistent=True,
         entry_points=[CallbackQueryHandler(admin_add_prize, pattern="^admin_add_prize$")],
         states={
             ADD_PRIZE_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_receive_new_prize_name)],
@@ -467,6 +3144,7 @@ def main():
     
     # --- ConversationHandler برای ویرایش جایزه توسط ادمین ---
     conv_handler_edit_prize = ConversationHandler(
+        name="edit_prize", persistent=True,
         entry_points=[CallbackQueryHandler(admin_edit_prize_start, pattern=r"^edit_prize_\d+$")],
         states={
             EDIT_PRIZE_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_receive_edited_prize_name)],
@@ -483,17 +3161,64 @@ def main():
     # --- هندلرهای عمومی ---
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("admin", admin_panel))
+    app.add_handler(CommandHandler("uncache", admin_uncache_user))
+    app.add_handler(CommandHandler("report", admin_report_command))
+    app.add_handler(CommandHandler("role", admin_set_role))
+    app.add_handler(CommandHandler("schedule", admin_schedule))
     
     # --- هندلرهای CallbackQuery ادمین ---
     app.add_handler(CallbackQueryHandler(admin_next_round, pattern="^admin_next_round$"))
     app.add_handler(CallbackQueryHandler(admin_manage_prizes, pattern="^admin_manage_prizes$"))
     app.add_handler(CallbackQueryHandler(admin_delete_prize, pattern=r"^delete_prize_\d+$"))
     app.add_handler(CallbackQueryHandler(admin_user_report, pattern="^admin_user_report$")) # اضافه شده
+    app.add_handler(CallbackQueryHandler(admin_report_page, pattern=r"^report_page_\d+(_\d*)?$"))
+    app.add_handler(CallbackQueryHandler(admin_report_export, pattern="^report_export_(csv|xlsx)$"))
+    app.add_handler(CallbackQueryHandler(admin_clear_member_cache, pattern="^admin_clear_member_cache$"))
+    app.add_handler(CallbackQueryHandler(admin_stats, pattern="^admin_stats$"))
+    app.add_handler(CallbackQueryHandler(admin_stats_round, pattern=r"^stats_round_\d+$"))
+    app.add_handler(CallbackQueryHandler(admin_broadcast_start, pattern="^admin_broadcast_start$"))
+    app.add_handler(CallbackQueryHandler(admin_broadcast_status, pattern="^admin_broadcast_status$"))
+    app.add_handler(CallbackQueryHandler(admin_broadcast_cancel, pattern="^admin_broadcast_cancel$"))
     app.add_handler(CallbackQueryHandler(admin_panel_back, pattern="^admin_panel_back$"))
+    instrument_handlers(app)
+    return app
+
+# --- Main function ---
+def main():
+    if not TOKEN:
+        raise RuntimeError("BOT_TOKEN not set! Please set the BOT_TOKEN environment variable.")
+
+    builder = ApplicationBuilder().token(TOKEN)
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+    app = build_app(builder)
+    allowed_updates = required_update_types(app)
 
+    if WORKERS > 1:
+        if STORAGE != "sqlite" or not WEBHOOK_URL:
+            raise RuntimeError("WORKERS needs STORAGE=sqlite and WEBHOOK_URL")
+        asyncio.run(run_frontend(allowed_updates))
+        return
 
     print("Bot running... Press Ctrl+C to stop.")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL:
+        # حالت webhook: سرور محلی پشت reverse proxy؛ تلگرام هدر secret token را می‌فرستد و
+        # درخواست‌های بدون آن رد می‌شوند
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=allowed_updates,
+        )
+    else:
+        app.run_polling(allowed_updates=allowed_updates)
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["migrate"]:
+        migrate_json_to_sqlite()
+    elif sys.argv[1:] == ["worker"]:
+        asyncio.run(run_worker(int(os.environ["WORKER_PORT"])))
+    else:
+        main()